@@ -0,0 +1,192 @@
+import io
+import json
+import hashlib
+import numpy as np
+from PIL import Image, ImageFilter
+import instrumentation
+
+# Offline photometric augmentation of generated frames, mimicking phone photos of the kit
+# taken in a classroom: uneven lighting, gamma, color cast, shadows, blur, sensor noise and
+# JPEG artifacts. Only pixel values change, so the labels stay valid.
+#
+# Every effect has a probability ('<effect>_p') and its parameter ranges; a preset is a dict
+# of them and a run can override any value (see load_params).
+
+PRESETS = {
+    'none': {},
+    'light': {
+        'gamma_p': 0.5, 'gamma': (0.8, 1.25),
+        'brightness_p': 0.5, 'brightness': (0.85, 1.15),
+        'contrast_p': 0.5, 'contrast': (0.85, 1.15),
+        'cast_p': 0.3, 'cast': 0.05,
+        'noise_p': 0.3, 'noise': (1.0, 4.0),
+        'jpeg_p': 0.2, 'jpeg': (60, 95),
+    },
+    'classroom': {
+        'gamma_p': 0.7, 'gamma': (0.7, 1.4),
+        'brightness_p': 0.7, 'brightness': (0.7, 1.2),
+        'contrast_p': 0.6, 'contrast': (0.75, 1.2),
+        'gradient_p': 0.5, 'gradient': (0.1, 0.35),
+        'cast_p': 0.5, 'cast': 0.08,
+        'shadow_p': 0.4, 'shadow': (0.25, 0.55),
+        'blur_p': 0.3, 'blur': (0.5, 1.8),
+        'noise_p': 0.6, 'noise': (2.0, 8.0),
+        'jpeg_p': 0.5, 'jpeg': (35, 85),
+    },
+}
+
+
+def load_params(preset='classroom', overrides=None):
+    """
+    Parameters of a preset updated with `overrides`: a dict, a JSON string or a JSON file path.
+    """
+    params = dict(PRESETS[preset])
+    if overrides:
+        if isinstance(overrides, str):
+            if overrides.lstrip().startswith('{'):
+                overrides = json.loads(overrides)
+            else:
+                with open(overrides) as f:
+                    overrides = json.load(f)
+        params.update({k: tuple(v) if isinstance(v, list) else v for k, v in overrides.items()})
+    return params
+
+
+def augment_rng(seed, index, copy=0):
+    """
+    NumPy generator of the augmentation of one sample, independent of the layout RNG,
+    so turning augmentation on or off does not change the rendered scenes.
+    """
+    digest = hashlib.sha1(f"{seed}:{index}:{copy}:augment".encode()).digest()
+    return np.random.default_rng(int.from_bytes(digest[:8], 'little'))
+
+
+# Bank of standard normal values, sensor noise rows are random slices of it: generating
+# fresh normals for a whole frame costs more than every other effect together
+NOISE_BANK_SIZE = 1 << 20
+_noise_bank = None
+
+
+def _noise(height, width, channels, rng):
+    global _noise_bank
+    if _noise_bank is None:
+        _noise_bank = np.random.default_rng(0).standard_normal(NOISE_BANK_SIZE, dtype=np.float32)
+    rows = np.lib.stride_tricks.sliding_window_view(_noise_bank, width * channels)
+    return rows[rng.integers(0, len(rows), height)].reshape(height, width, channels)
+
+
+def _apply(params, name, rng):
+    return params.get(name) is not None and rng.random() < params.get(name + '_p', 0.0)
+
+
+def _uniform(rng, bounds):
+    return rng.uniform(bounds[0], bounds[1])
+
+
+def _shadow_mask(height, width, rng, strength):
+    """
+    Soft-edged shadow over a random half plane, as (H, W, 1) multiplicative factors.
+    """
+    angle = rng.uniform(0, 2 * np.pi)
+    cx, cy = rng.uniform(0.2, 0.8) * width, rng.uniform(0.2, 0.8) * height
+    softness = rng.uniform(0.03, 0.15) * max(width, height)
+    ys = (np.arange(height, dtype=np.float32) - cy)[:, None] * np.float32(np.sin(angle))
+    xs = (np.arange(width, dtype=np.float32) - cx)[None, :] * np.float32(np.cos(angle))
+    inside = np.clip((xs + ys) / softness + 0.5, 0.0, 1.0)
+    return (1.0 - strength * inside)[..., None]
+
+
+def _gradient_mask(height, width, rng, strength):
+    """
+    Linear illumination falloff across the frame (one side lit, the other darker).
+    """
+    angle = rng.uniform(0, 2 * np.pi)
+    ys = np.linspace(-0.5, 0.5, height, dtype=np.float32)[:, None] * np.float32(np.sin(angle))
+    xs = np.linspace(-0.5, 0.5, width, dtype=np.float32)[None, :] * np.float32(np.cos(angle))
+    return (1.0 + strength * (xs + ys))[..., None]
+
+
+def augment_array(image, params, rng):
+    """
+    Augmented copy of an HxWx3 or HxWx4 uint8 array (alpha is kept as is).
+    `rng` is a numpy Generator (see augment_rng).
+    """
+    # Every channel is processed (contiguous memory is much faster than an RGB view of RGBA),
+    # the alpha channel is put back at the end
+    pixels = image.astype(np.float32)
+    height, width, channels = pixels.shape
+
+    if _apply(params, 'brightness', rng):
+        pixels *= _uniform(rng, params['brightness'])
+    if _apply(params, 'contrast', rng):
+        mean = pixels[..., :3].mean()
+        pixels -= mean
+        pixels *= _uniform(rng, params['contrast'])
+        pixels += mean
+    # Uneven lighting and shadows, combined in a single multiplication
+    light = None
+    if _apply(params, 'gradient', rng):
+        light = _gradient_mask(height, width, rng, _uniform(rng, params['gradient']))
+    if _apply(params, 'shadow', rng):
+        shadow = _shadow_mask(height, width, rng, _uniform(rng, params['shadow']))
+        light = shadow if light is None else light * shadow
+    if light is not None:
+        pixels *= light
+    if _apply(params, 'cast', rng):
+        gains = np.ones(channels, dtype=np.float32)
+        gains[:3] += rng.normal(0.0, params['cast'], 3).astype(np.float32)
+        pixels *= gains
+    if _apply(params, 'gamma', rng):
+        np.clip(pixels, 0, 255, out=pixels)
+        pixels *= 1 / 255
+        pixels **= 1 / _uniform(rng, params['gamma'])
+        pixels *= 255
+    if _apply(params, 'noise', rng):
+        # Read noise plus a shot noise component growing with the signal
+        sigma = _uniform(rng, params['noise'])
+        np.clip(pixels, 0, 255, out=pixels)
+        scale = pixels * np.float32(sigma / 16)
+        scale += sigma * sigma
+        np.sqrt(scale, out=scale)
+        scale *= _noise(height, width, channels, rng)
+        pixels += scale
+
+    np.clip(pixels, 0, 255, out=pixels)
+    np.rint(pixels, out=pixels)
+    out = pixels.astype(np.uint8)
+    if channels == 4:
+        out[..., 3] = image[..., 3]
+
+    blur = _uniform(rng, params['blur']) if _apply(params, 'blur', rng) else None
+    quality = int(_uniform(rng, params['jpeg'])) if _apply(params, 'jpeg', rng) else None
+    if blur is not None or quality is not None:
+        out = _pil_effects(out, blur, quality)
+    return out
+
+
+def _pil_effects(image, blur, quality):
+    # Blur and JPEG round trip are left to PIL's C code
+    pil = Image.fromarray(image)
+    alpha = pil.getchannel('A') if pil.mode == 'RGBA' else None
+    pil = pil.convert('RGB')
+    if blur is not None:
+        pil = pil.filter(ImageFilter.GaussianBlur(blur))
+    if quality is not None:
+        buffer = io.BytesIO()
+        pil.save(buffer, 'JPEG', quality=quality)
+        buffer.seek(0)
+        pil = Image.open(buffer)
+        pil.load()
+    if alpha is not None:
+        pil.putalpha(alpha)
+    return np.asarray(pil)
+
+
+def augment_image(image, params, rng):
+    """
+    Augments a PIL image or a uint8 array, returning the same kind.
+    """
+    with instrumentation.stage('augment'):
+        if isinstance(image, np.ndarray):
+            return augment_array(image, params, rng)
+        return Image.fromarray(augment_array(np.asarray(image), params, rng))
@@ -0,0 +1,162 @@
+import os
+import struct
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+import instrumentation
+
+# Default memory budget for normalized backgrounds kept in RAM (bytes).
+# The stock bg/ directory needs ~200MB once normalized to RGBA.
+BACKGROUND_MEMORY_BUDGET = 512 * 1024 * 1024
+
+MIN_HEIGHT = 1000
+MAX_HEIGHT = 1024
+
+_RAW_HEADER = struct.Struct('<II')
+
+
+def normalize_background(img):
+    """
+    Converts a background to RGBA and clamps its height to 1000-1024px keeping the aspect ratio.
+    """
+    base_image = img.convert("RGBA")
+    width, height = base_image.size
+
+    # Redimensionar BG se altura > 1024, mantendo proporção
+    if height > MAX_HEIGHT:
+        new_height = MAX_HEIGHT
+        new_width = int(width * (new_height / height))
+        base_image = base_image.resize((new_width, new_height), Image.LANCZOS)
+        width, height = base_image.size
+
+    # Redimensionar BG se altura for menor que 1000
+    if height < MIN_HEIGHT:
+        new_height = MIN_HEIGHT
+        new_width = int(width * (new_height / height))
+        base_image = base_image.resize((new_width, new_height), Image.LANCZOS)
+
+    return base_image
+
+
+def load_background(path):
+    with Image.open(path) as img:
+        return normalize_background(img)
+
+
+class BackgroundCache:
+    """
+    Keeps normalized RGBA backgrounds in memory (LRU bounded by `memory_budget` bytes).
+
+    When `cache_dir` is given, normalized frames are also stored there as raw RGBA,
+    so later runs (or other processes) skip the JPEG decode and resize entirely.
+    Every frame is kept as a read-only HxWx4 uint8 array and a PIL image sharing its memory,
+    get() returns the image and get_array() the array. Treat both as read-only.
+    """
+
+    def __init__(self, memory_budget=BACKGROUND_MEMORY_BUDGET, cache_dir=None):
+        self.memory_budget = memory_budget
+        self.cache_dir = cache_dir
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _raw_path(self, path):
+        st = os.stat(path)
+        key = f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}:{MIN_HEIGHT}:{MAX_HEIGHT}"
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.cache_dir, f"{name}-{digest}.rgba")
+
+    def _read_raw(self, raw_path):
+        with open(raw_path, 'rb') as f:
+            data = f.read()
+        width, height = _RAW_HEADER.unpack_from(data)
+        return Image.frombuffer('RGBA', (width, height), memoryview(data)[_RAW_HEADER.size:], 'raw', 'RGBA', 0, 1)
+
+    def _write_raw(self, raw_path, img):
+        tmp_path = raw_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_RAW_HEADER.pack(*img.size))
+            f.write(img.tobytes())
+        os.replace(tmp_path, raw_path)
+
+    def _load(self, path):
+        with instrumentation.stage('background'):
+            if not self.cache_dir:
+                return load_background(path)
+            raw_path = self._raw_path(path)
+            if os.path.exists(raw_path):
+                return self._read_raw(raw_path)
+            img = load_background(path)
+            self._write_raw(raw_path, img)
+            return img
+
+    def _frame(self, path):
+        key = os.path.abspath(path)
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frame
+
+        self.misses += 1
+        array = np.asarray(self._load(path))
+        array.flags.writeable = False
+        frame = (Image.frombuffer('RGBA', (array.shape[1], array.shape[0]), array, 'raw', 'RGBA', 0, 1), array)
+        size = array.nbytes
+        if size > self.memory_budget:
+            return frame
+
+        while self._frames and self.used_bytes + size > self.memory_budget:
+            _, (_, old) = self._frames.popitem(last=False)
+            self.used_bytes -= old.nbytes
+        self._frames[key] = frame
+        self.used_bytes += size
+        return frame
+
+    def get(self, path):
+        return self._frame(path)[0]
+
+    def get_array(self, path):
+        return self._frame(path)[1]
+
+    def preload(self, paths):
+        for path in paths:
+            self.get(path)
+
+    def clear(self):
+        self._frames.clear()
+        self.used_bytes = 0
+
+
+_default_cache = None
+
+
+def get_background_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = BackgroundCache()
+    return _default_cache
+
+
+def set_background_cache(cache):
+    global _default_cache
+    _default_cache = cache
+
+
+def get_background(path):
+    """
+    Normalized RGBA background for `path`, served from the process-wide cache.
+    """
+    return get_background_cache().get(path)
+
+
+def get_background_array(path):
+    """
+    Same frame as get_background(path), as a read-only HxWx4 uint8 array (no copy).
+    """
+    return get_background_cache().get_array(path)
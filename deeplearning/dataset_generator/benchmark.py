@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+import generate_artificial_dataset as gen
+from stream import SyntheticDataset
+
+# Fixed workload: the same seed always renders the same scenes over the real bg/, sets/ and img_blocks* assets
+BENCH_SEED = 1234
+BENCH_IMAGES = 60
+
+
+def _timed_unit(index):
+    start = time.perf_counter()
+    result = gen.generate_unit(index)
+    return result['ok'], time.perf_counter() - start, os.getpid(), _max_rss()
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def _latency_stats(latencies):
+    ms = [t * 1000 for t in latencies]
+    return {
+        'mean': sum(ms) / len(ms) if ms else 0.0,
+        'p50': _percentile(ms, 0.50),
+        'p90': _percentile(ms, 0.90),
+        'p99': _percentile(ms, 0.99),
+        'max': max(ms) if ms else 0.0
+    }
+
+
+def _max_rss():
+    # Peak RSS of this process in bytes (ru_maxrss is in KB on Linux, bytes on macOS)
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+
+
+def _peak_rss_mb(worker_peaks=None):
+    """
+    Peak RSS of this process plus the peaks of its pool workers ({pid: bytes}).
+    RUSAGE_CHILDREN only reports the largest child, which hides most of a pool's memory.
+    Pages shared with the parent after fork count once per process, so it is an upper bound.
+    """
+    return (_max_rss() + sum((worker_peaks or {}).values())) / (1024 * 1024)
+
+
+def _run_files(bench, output_dir):
+    """
+    Writes `images` samples through the regular generate_unit + SampleWriter path.
+    Per-image latency covers planning and rendering; encoding runs in the writer threads
+    and is accounted in the total elapsed time. Also returns the peak RSS of every pool
+    worker ({pid: bytes}, as last reported by its units).
+    """
+    config = gen.make_config(bench['seed'], diroutput=output_dir, writer=bench['writer'], backend=bench.get('backend', 'pil'))
+    os.makedirs(output_dir, exist_ok=True)
+    workers = bench['workers']
+    indexes = range(bench['images'])
+
+    start = time.perf_counter()
+    if workers > 1:
+        with multiprocessing.Pool(workers, initializer=gen._init_worker, initargs=(config,)) as pool:
+            results = list(pool.imap_unordered(_timed_unit, indexes, chunksize=4))
+            pool.close()
+            pool.join()
+    else:
+        gen._init_worker(config)
+        results = [_timed_unit(index) for index in indexes]
+        gen._writer.close()
+        if gen._label_index is not None:
+            gen._label_index.close()
+    elapsed = time.perf_counter() - start
+    worker_peaks = {}
+    if workers > 1:
+        for _, _, pid, rss in results:
+            worker_peaks[pid] = max(worker_peaks.get(pid, 0), rss)
+    latencies = [t for ok, t, _, _ in results if ok]
+    return elapsed, latencies, sum(1 for ok, _, _, _ in results if not ok), worker_peaks
+
+
+def _run_memory(bench):
+    """
+    Renders through the in-memory stream API, nothing is encoded nor written.
+    """
+    dataset = SyntheticDataset(seed=bench['seed'], backend=bench.get('backend', 'pil'))
+    latencies = []
+    rejected = 0
+    start = time.perf_counter()
+    for index in range(bench['images']):
+        t = time.perf_counter()
+        sample = dataset.render_unit(index)
+        if sample is None:
+            rejected += 1
+        else:
+            latencies.append(time.perf_counter() - t)
+    return time.perf_counter() - start, latencies, rejected
+
+
+def run_benchmark(bench):
+    """
+    Runs one benchmark configuration in the current process and returns its result dict.
+    Meant to run in a fresh process (see main) so the peak memory is its own.
+    """
+    output_dir = tempfile.mkdtemp(prefix='ory_bench_')
+    worker_peaks = None
+    try:
+        if bench['mode'] == 'memory':
+            elapsed, latencies, rejected = _run_memory(bench)
+        else:
+            elapsed, latencies, rejected, worker_peaks = _run_files(bench, output_dir)
+        output_bytes = sum(e.stat().st_size for e in os.scandir(output_dir))
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    return dict(bench,
+                elapsed=elapsed,
+                generated=len(latencies),
+                rejected=rejected,
+                images_per_sec=len(latencies) / elapsed if elapsed else 0.0,
+                latency_ms=_latency_stats(latencies),
+                peak_rss_mb=_peak_rss_mb(worker_peaks),
+                output_mb=output_bytes / (1024 * 1024))
+
+
+def default_benchmarks(images, seed, workers_list, image_format, backend='pil'):
+    writer = {'image_format': image_format}
+    common = {'images': images, 'seed': seed, 'writer': writer, 'backend': backend}
+    benches = [dict(common, name='memory', mode='memory', workers=1),
+               dict(common, name='serial', mode='files', workers=1)]
+    for workers in workers_list:
+        benches.append(dict(common, name=f'parallel-{workers}', mode='files', workers=workers))
+    return benches
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'benchmark':<14}{'images':>8}{'img/s':>9}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'peak MB':>9}")
+    for r in results:
+        lat = r['latency_ms']
+        print(f"{r['name']:<14}{r['generated']:>8}{r['images_per_sec']:>9.2f}{lat['p50']:>9.1f}{lat['p90']:>9.1f}{lat['p99']:>9.1f}{r['peak_rss_mb']:>9.0f}")
+
+
+def compare(old_file, new_file):
+    with open(old_file) as f:
+        old = {r['name']: r for r in json.load(f)['results']}
+    with open(new_file) as f:
+        new = {r['name']: r for r in json.load(f)['results']}
+    print(f"{'benchmark':<14}{'old img/s':>11}{'new img/s':>11}{'speedup':>9}{'old p50':>9}{'new p50':>9}{'old MB':>8}{'new MB':>8}")
+    for name in old:
+        if name not in new:
+            continue
+        o, n = old[name], new[name]
+        speedup = n['images_per_sec'] / o['images_per_sec'] if o['images_per_sec'] else float('nan')
+        print(f"{name:<14}{o['images_per_sec']:>11.2f}{n['images_per_sec']:>11.2f}{speedup:>8.2f}x"
+              f"{o['latency_ms']['p50']:>9.1f}{n['latency_ms']['p50']:>9.1f}{o['peak_rss_mb']:>8.0f}{n['peak_rss_mb']:>8.0f}")
+
+
+def _bench_process(bench, conn):
+    conn.send(run_benchmark(bench))
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the synthetic dataset generator.")
+    parser.add_argument("--images", "-n", type=int, default=BENCH_IMAGES, help="Scenes per benchmark.")
+    parser.add_argument("--seed", type=int, default=BENCH_SEED, help="Workload seed (keep it fixed to compare revisions).")
+    parser.add_argument("--workers", default=str(min(4, os.cpu_count() or 1)), help="Comma separated worker counts of the parallel benchmarks.")
+    parser.add_argument("--format", default="png", help="Output image format of the file benchmarks.")
+    parser.add_argument("--backend", default="pil", help="Compositing backend (pil or numpy).")
+    parser.add_argument("--only", help="Comma separated benchmark names to run (memory, serial, parallel-N).")
+    parser.add_argument("--output", "-o", help="Save the results as JSON.")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two saved JSON results and exit.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    workers_list = [int(w) for w in args.workers.split(',') if w and int(w) > 1]
+    benches = default_benchmarks(args.images, args.seed, workers_list, args.format, args.backend)
+    if args.only:
+        wanted = set(args.only.split(','))
+        benches = [b for b in benches if b['name'] in wanted]
+
+    results = []
+    ctx = multiprocessing.get_context('fork') if hasattr(os, 'fork') else multiprocessing.get_context()
+    for bench in benches:
+        print(f"Running {bench['name']}...")
+        # Fresh process per benchmark: cold caches and its own peak memory
+        parent_conn, child_conn = ctx.Pipe()
+        proc = ctx.Process(target=_bench_process, args=(bench, child_conn))
+        proc.start()
+        results.append(parent_conn.recv())
+        proc.join()
+
+    print_results(results)
+    if args.output:
+        report = {
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'results': results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import math
+from functools import lru_cache
+import numpy as np
+from PIL import Image
+from sprites import SPRITE_CACHE_SIZE, get_sprite
+import instrumentation
+from homography import coeffs_to_matrix, matrix_to_coeffs, transform_boxes
+
+# Transparent border kept around the drawn blocks, so bicubic sampling near the
+# edges of the cropped layer reads the same (empty) pixels as on a full canvas
+LAYER_MARGIN = 4
+
+# Compositing backends: 'pil' draws with Image.paste/alpha_composite on new images,
+# 'numpy' blends premultiplied sprites into a reused buffer (see render_blocks_array)
+BACKENDS = ('pil', 'numpy')
+
+
+def content_bounds(placements, size, margin=LAYER_MARGIN):
+    """
+    (x0, y0, x1, y1) enclosing every placement rect plus `margin`, clipped to the canvas `size`.
+    """
+    rects = np.asarray([p['rect'] for p in placements], dtype=np.int64)
+    x0 = max(0, int(rects[:, 0].min()) - margin)
+    y0 = max(0, int(rects[:, 1].min()) - margin)
+    x1 = min(size[0], int((rects[:, 0] + rects[:, 2]).max()) + margin)
+    y1 = min(size[1], int((rects[:, 1] + rects[:, 3]).max()) + margin)
+    return x0, y0, x1, y1
+
+
+def render_blocks_layer(placements, blocks_dir, size, origin=(0, 0)):
+    """
+    Draws the planned sprites (see layout.plan_layout) on a transparent layer of `size`
+    whose top-left pixel is at `origin` in canvas coordinates.
+    """
+    blocks_layer = Image.new('RGBA', size, (0, 0, 0, 0))
+    for p in placements:
+        with instrumentation.stage('sprites'):
+            # Arrow variants come pre-rotated from the sprite cache
+            sprite = get_sprite(blocks_dir, p['sprite'], p['size'], p['angle'])
+        with instrumentation.stage('paste'):
+            blocks_layer.paste(sprite, (p['rect'][0] - origin[0], p['rect'][1] - origin[1]), mask=sprite)
+    return blocks_layer
+
+
+def warped_region(layer_size, origin, fwd_coeffs, canvas_size, margin=1):
+    """
+    Canvas region (x0, y0, x1, y1) covered by the layer once transformed by `fwd_coeffs`.
+    """
+    rect = [origin[0], origin[1], layer_size[0], layer_size[1]]
+    min_x, min_y, max_x, max_y = transform_boxes([rect], fwd_coeffs, canvas_size[0], canvas_size[1])[0]
+    x0 = max(0, math.floor(min_x) - margin)
+    y0 = max(0, math.floor(min_y) - margin)
+    x1 = min(canvas_size[0], math.ceil(max_x) + margin)
+    y1 = min(canvas_size[1], math.ceil(max_y) + margin)
+    return x0, y0, x1, y1
+
+
+def region_coeffs(bwd_coeffs, region, origin):
+    """
+    Backward coefficients for a warp restricted to `region` of the destination, sampling
+    a layer placed at `origin`: local dest -> global dest -> global source -> local source.
+    """
+    to_global = np.array([[1, 0, region[0]], [0, 1, region[1]], [0, 0, 1]], dtype=np.float64)
+    to_local = np.array([[1, 0, -origin[0]], [0, 1, -origin[1]], [0, 0, 1]], dtype=np.float64)
+    return matrix_to_coeffs(to_local @ coeffs_to_matrix(bwd_coeffs) @ to_global)
+
+
+def warp_onto(base_image, layer, origin, fwd_coeffs, bwd_coeffs):
+    """
+    Warps `layer` (placed at `origin` in source coordinates) with the perspective given by
+    fwd/bwd coefficients and alpha composites it onto a copy of `base_image`.
+    Only the region the layer lands on is transformed and composited.
+    """
+    canvas_size = base_image.size
+    region = warped_region(layer.size, origin, fwd_coeffs, canvas_size)
+    with instrumentation.stage('composite'):
+        final_image = base_image.copy()
+    if region[2] <= region[0] or region[3] <= region[1]:
+        return final_image
+
+    with instrumentation.stage('warp'):
+        coeffs = region_coeffs(bwd_coeffs, region, origin)
+        transformed = layer.transform((region[2] - region[0], region[3] - region[1]), Image.PERSPECTIVE, coeffs.tolist(), Image.BICUBIC)
+    with instrumentation.stage('composite'):
+        final_image.alpha_composite(transformed, dest=(region[0], region[1]))
+    return final_image
+
+
+# --- NumPy backend ---
+# Same results as the PIL functions above: the integer blending formulas are the ones of
+# Pillow's paste (mask) and alpha_composite, only the perspective warp itself is left to PIL.
+
+# Flat buffer the block layer is drawn into, grown on demand and reused by every sample
+_layer_buffer = np.zeros(0, dtype=np.uint8)
+
+
+def _div255(a):
+    # Pillow's DIV255: exact rounding of a / 255 for 0 <= a <= 255 * 255 + 128
+    a = a + 128
+    return ((a >> 8) + a) >> 8
+
+
+@lru_cache(maxsize=SPRITE_CACHE_SIZE)
+def _sprite_planes(blocks_dir, name, size, angle):
+    sprite = np.asarray(get_sprite(blocks_dir, name, size, angle), dtype=np.uint16)
+    mask = sprite[..., 3:4]
+    # Premultiplied by its own alpha (the paste mask) and the weight left to the destination
+    return sprite * mask, 255 - mask
+
+
+def sprite_planes(blocks_dir, name, size, angle=None):
+    """
+    (premultiplied, inverse mask) uint16 arrays of a sprite, as used by render_blocks_array.
+    Cached like the sprites themselves, treat them as read-only.
+    """
+    return _sprite_planes(blocks_dir, name, tuple(size), angle)
+
+
+def _layer_array(size):
+    global _layer_buffer
+    nbytes = size[0] * size[1] * 4
+    if _layer_buffer.size < nbytes:
+        _layer_buffer = np.zeros(nbytes, dtype=np.uint8)
+    layer = _layer_buffer[:nbytes].reshape(size[1], size[0], 4)
+    layer.fill(0)
+    return layer
+
+
+def render_blocks_array(placements, blocks_dir, size, origin=(0, 0)):
+    """
+    NumPy version of render_blocks_layer, returning an HxWx4 uint8 array.
+    The array is a view of a buffer reused by the next call (of this process): consume it
+    (e.g. warp_array_onto) before rendering another layer.
+    """
+    layer = _layer_array(size)
+    height, width = layer.shape[:2]
+    for p in placements:
+        with instrumentation.stage('sprites'):
+            premultiplied, inverse = sprite_planes(blocks_dir, p['sprite'], p['size'], p['angle'])
+        with instrumentation.stage('paste'):
+            x, y = p['rect'][0] - origin[0], p['rect'][1] - origin[1]
+            h, w = premultiplied.shape[:2]
+            # Clip to the layer, as paste does
+            sx0, sy0 = max(0, -x), max(0, -y)
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(width, x + w), min(height, y + h)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            src = (slice(sy0, sy0 + y1 - y0), slice(sx0, sx0 + x1 - x0))
+            dst = layer[y0:y1, x0:x1]
+            dst[...] = _div255(dst * inverse[src] + premultiplied[src])
+    return layer
+
+
+def alpha_composite_array(dst, src):
+    """
+    In place `dst` over-composited with `src` (both HxWx4 uint8), with Pillow's alpha_composite math.
+    Only the pixels where `src` is visible are computed.
+    """
+    if dst[..., 3].min() == 255:
+        # Opaque destination (every background): the result reduces to DIV255(src * a + dst * (255 - a))
+        a = src[..., 3:4]
+        x = np.multiply(src[..., :3], a, dtype=np.uint16)
+        x += np.subtract(255, a, dtype=np.uint16) * dst[..., :3]
+        dst[..., :3] = _div255(x)
+        return
+    visible = src[..., 3] > 0
+    s = src[visible].astype(np.uint32)
+    d = dst[visible].astype(np.uint32)
+    src_a = s[:, 3:4]
+    outa255 = src_a * 255 + d[:, 3:4] * (255 - src_a)
+    coef1 = src_a * (255 * 255 * 128) // outa255
+    coef2 = 255 * 128 - coef1
+    tmp = s[:, :3] * coef1 + d[:, :3] * coef2 + (0x80 << 7)
+    d[:, :3] = (((tmp >> 8) + tmp) >> 8) >> 7
+    a = outa255 + 0x80
+    d[:, 3:4] = ((a >> 8) + a) >> 8
+    dst[visible] = d
+
+
+def warp_array_onto(base, layer, origin, fwd_coeffs, bwd_coeffs):
+    """
+    NumPy version of warp_onto: `base` and `layer` are HxWx4 uint8 arrays (see
+    backgrounds.get_background_array and render_blocks_array), the result a new
+    HxWx4 uint8 array owned by the caller.
+    """
+    with instrumentation.stage('composite'):
+        final_image = base.copy()
+    canvas_size = (final_image.shape[1], final_image.shape[0])
+    layer_size = (layer.shape[1], layer.shape[0])
+    region = warped_region(layer_size, origin, fwd_coeffs, canvas_size)
+    if region[2] <= region[0] or region[3] <= region[1]:
+        return final_image
+
+    with instrumentation.stage('warp'):
+        coeffs = region_coeffs(bwd_coeffs, region, origin)
+        source = Image.frombuffer('RGBA', layer_size, layer, 'raw', 'RGBA', 0, 1)
+        transformed = source.transform((region[2] - region[0], region[3] - region[1]), Image.PERSPECTIVE, coeffs.tolist(), Image.BICUBIC)
+    with instrumentation.stage('composite'):
+        alpha_composite_array(final_image[region[1]:region[3], region[0]:region[2]], np.asarray(transformed))
+    return final_image
@@ -1,272 +1,119 @@
 from PIL import Image
-import re
+import numpy as np
 import random
-import copy
 import os
-from datetime import datetime
-
-def proc_txt_file(input_file):
-    filetxt= open(input_file,'r')
-    _blocks=[]
-    _last={}
-    print("Loading blocks:\n")
-    i=0
-    for line in filetxt:
-        i+=1
-        print("#"+str(i)+" - "+line)
-        blockvalues=line.replace("\n","").split('=')[1].split(',')
-        block={}
-        block['name']=line.replace("\n","").split('=')[0]
-        if block['name'].find('~[')>=0:
-            arra=eval(block['name'][1:len(block['name'])])
-            block['name']=arra[random.randint(0,len(arra)-1)]
-
-        idx=0
-        for t in blockvalues:
-            _blockValue=t
-            _values = re.findall(r'\(.*?\)',_blockValue)
-            for _v in _values:
-                if _v.find("~")>0:
-                    strValue=_v[1:len(_v)-1]
-                    _newValue=random.randint(int(strValue.split('~')[0]),int(strValue.split('~')[1]))
-                    _blockValue=_blockValue.replace(strValue,str(_newValue))
-            if idx==0:
-                block['x']=eval(_blockValue,{"last":_last})
-            if idx==1:
-                block['y']=eval(_blockValue,{"last":_last})
-            if idx==2:
-                block['direction']=_blockValue
-                if _blockValue=='random':
-                    varr=['left','right','down','up']
-                    block['direction']=varr[random.randint(0,3)]
-            if idx==3:
-                block['steps']=eval(_blockValue)
-            
-            idx+=1
-
-                
-        _blocks.append(block)
-        _last=copy.deepcopy(block)
-    return _blocks
+import time
+import hashlib
+import argparse
+import functools
+import multiprocessing
+import multiprocessing.util
+import tempfile
+import shutil
+from collections import Counter
+import instrumentation
+from compositing import BACKENDS, content_bounds, render_blocks_array, render_blocks_layer, warp_array_onto, warp_onto
+from setfile import compile_set_file
+from layout import CLASS_LIST, MAX_LAYOUT_ATTEMPTS, LayoutStats, plan_layout, plan_scene
+from homography import compose_coeffs, scale_coeffs, solve_homography, transform_points, transform_boxes, boxes_to_yolo
+from writer import IMAGE_FORMATS, SampleWriter
+from shards import SAMPLES_PER_SHARD, ShardWriter
+from labelindex import LABEL_INDEX_DIR, LabelIndexWriter, prune_label_index
+from manifest import MANIFEST_NAME, Manifest, blocks_digest, file_digest, remove_samples
+from scheduler import BATCH_UNITS, BIAS_STRENGTH, MAX_STALLED_UNITS, ClassBalancedScheduler, parse_quotas
+from augment import PRESETS as AUGMENT_PRESETS, augment_image, augment_rng, load_params as load_augment_params
+from backgrounds import BackgroundCache, get_background, get_background_array, get_background_cache, set_background_cache
+from sprites import set_atlas_cache_dir
+
+def proc_txt_file(input_file, rng=random):
+    """
+    Samples one block layout from a set file.
+    The file is compiled once per process (see setfile.py), each call only draws the random values.
+    """
+    with instrumentation.stage('sample'):
+        return compile_set_file(input_file).sample(rng)
 
 def solve_system(matrix, result_vector):
     """
-    Solves a system of linear equations Ax = B using Gaussian elimination.
+    Solves a system of linear equations Ax = B.
     matrix: list of lists (A)
     result_vector: list (B)
     returns: list (x)
     """
-    n = len(matrix)
-    # Combine matrix and result_vector into an augmented matrix
-    M = [row[:] + [result_vector[i]] for i, row in enumerate(matrix)]
-
-    # Forward elimination
-    for i in range(n):
-        # Pivot
-        pivot = M[i][i]
-        if abs(pivot) < 1e-10:
-            # Swap with a row below having non-zero pivot
-            for k in range(i + 1, n):
-                if abs(M[k][i]) > 1e-10:
-                    M[i], M[k] = M[k], M[i]
-                    pivot = M[i][i]
-                    break
-            else:
-                raise ValueError("Singular matrix")
-
-        # Normalize pivot row
-        for j in range(i, n + 1):
-            M[i][j] /= pivot
-
-        # Eliminate entries below
-        for k in range(i + 1, n):
-            factor = M[k][i]
-            for j in range(i, n + 1):
-                M[k][j] -= factor * M[i][j]
-
-    # Backward substitution
-    x = [0] * n
-    for i in range(n - 1, -1, -1):
-        sum_ax = sum(M[i][j] * x[j] for j in range(i + 1, n))
-        x[i] = M[i][n] - sum_ax
-
-    return x
+    try:
+        return np.linalg.solve(np.asarray(matrix, dtype=np.float64), np.asarray(result_vector, dtype=np.float64)).tolist()
+    except np.linalg.LinAlgError:
+        raise ValueError("Singular matrix")
 
 def find_coeffs(source_coords, target_coords):
-    matrix = []
-    # coefficients mapping source to target
-    # x_dest = (a*x_src + b*y_src + c) / (g*x_src + h*y_src + 1)
-    # y_dest = (d*x_src + e*y_src + f) / (g*x_src + h*y_src + 1)
-    #
-    # a*x_src + b*y_src + c - g*x_src*x_dest - h*y_src*x_dest = x_dest
-    # d*x_src + e*y_src + f - g*x_src*y_dest - h*y_src*y_dest = y_dest
-    
-    # We want 8 coefficients: a, b, c, d, e, f, g, h
-    
-    b_vec = []
-    
-    for s, t in zip(source_coords, target_coords):
-        # Equation for x
-        # [x, y, 1, 0, 0, 0, -x*X, -y*X] * [coeffs] = X
-        matrix.append([s[0], s[1], 1, 0, 0, 0, -s[0]*t[0], -s[1]*t[0]])
-        b_vec.append(t[0])
-        
-        # Equation for y
-        # [0, 0, 0, x, y, 1, -x*Y, -y*Y] * [coeffs] = Y
-        matrix.append([0, 0, 0, s[0], s[1], 1, -s[0]*t[1], -s[1]*t[1]])
-        b_vec.append(t[1])
-        
-    return solve_system(matrix, b_vec)
+    """
+    Perspective coefficients mapping source_coords to target_coords (see homography.py).
+    Use solve_homography directly when both directions are needed, it solves only once.
+    """
+    forward, _ = solve_homography(source_coords, target_coords)
+    return forward.tolist()
 
 def transform_point(point, coeffs):
     """
     Transforms a point (x, y) using the perspective coefficients.
     """
-    a, b, c, d, e, f, g, h = coeffs
-    
-    x, y = point
-    denominator = g * x + h * y + 1
-    if abs(denominator) < 1e-10: return x, y 
-    
-    new_x = (a * x + b * y + c) / denominator
-    new_y = (d * x + e * y + f) / denominator
-    return new_x, new_y
+    new_x, new_y = transform_points([point], coeffs)[0]
+    return float(new_x), float(new_y)
 
-def generate_img_blocks(blocks,backGroundImageFile,OutputImageFile,OutputYoloFile, blocks_dir="img_blocks"):
-    base_image = Image.open(backGroundImageFile).convert("RGBA")
-    width, height = base_image.size
-    
-    # Redimensionar BG se altura > 1024, mantendo proporção
-    if height > 1024:
-        new_height = 1024
-        new_width = int(width * (new_height / height))
-        base_image = base_image.resize((new_width, new_height), Image.LANCZOS)
-        width, height = base_image.size
-
-    # Redimensionar BG se altura for menor que 1000
-    if height < 1000:
-        new_height = 1000
-        new_width = int(width * (new_height / height))
-        base_image = base_image.resize((new_width, new_height), Image.LANCZOS)
-        width, height = base_image.size
-    
-    # Create the transparent layer for blocks
-    blocks_layer = Image.new('RGBA', (width, height), (0,0,0,0))
-    
-    blck_perc=550/width
-    
-    # Define granular classes
-    class_list = [
-        'andar', 'circulo', 'inicio', 'looping', 'pegar', 'pular', 'triangulo', 'zzz',
-        '2', '3', '4', '5', '6', '7', '8', '9',
-        'seta_up', 'seta_down', 'seta_left', 'seta_right'
-    ]
-    dicObj = {name: i for i, name in enumerate(class_list)}
-    
-    # Write obj.names if it doesn't exist or is different (Helper to ensure consistency)
-    # We write it to the output directory so data_utils can find it
-    names_file_path = os.path.join(os.path.dirname(OutputYoloFile), 'obj.names')
-    # If we haven't written it in this run yet (or strictly checking), just overwrite for safety
-    # But this function is called per image. Let's do it once in main or check existence.
-    # For now, just rely on prints or do it in main.
-    
-    # Store objects to annotate: {'class_id': int, 'rect': [x, y, w, h]}
-    # We will process/draw them all first on the transparent layer
-    objects_to_transform = [] 
-
-    # First pass: Check for bounds validity (Logic same as before)
-    # We can reuse the loop or integrate it. 
-    # For cleaner code, let's just do one pass to DRAW and COLLECT BBOXes.
-    # If any fail bounds, we abort.
-    
-    # We need to buffer the draw operations because if one fails we must abort the whole image
-    # But since we are writing to a temp blocks_layer, we can just return early and discard it.
-    
-    for b in blocks:
-        blck_image_path=os.path.join(blocks_dir, b['name']+'.png')
-        blckInicio = Image.open(blck_image_path)
-        newwidth=round(blckInicio.size[0]*blck_perc)
-        newheight=round(blckInicio.size[1]*blck_perc)
-        
-        # Check block bounds
-        if b['x'] < 0 or b['y'] < 0 or (b['x'] + newwidth) > width or (b['y'] + newheight) > height:
-            #print(f"Skipping image: Block {b['name']} out of bounds at ({b['x']}, {b['y']})")
-            return
-
-        blckInicio=blckInicio.resize((newwidth,newheight),Image.LANCZOS)
-        blocks_layer.paste(blckInicio, (b['x'],b['y']), mask=blckInicio)
-        
-        # Map generic names to specific classes if needed, or assume b['name'] is in dict
-        # The text files have 'andar', 'pegar' etc which are in our list.
-        # But 'numero' is not. 'numero' comes from 'steps'.
-        if b['name'] in dicObj:
-             objects_to_transform.append({
-                'class': dicObj[b['name']],
-                'rect': (b['x'], b['y'], newwidth, newheight)
-            })
-        else:
-             # If it's not in dict (like if simple blocks provided numbers as names?), ignore or handle
-             pass
+def generate_img_blocks(blocks,backGroundImageFile,OutputImageFile,OutputYoloFile, blocks_dir="img_blocks", rng=random, augment=None, augment_key=None):
+    """
+    Renders `blocks` over the background and writes the image and its YOLO labels.
+    `augment` are photometric augmentation parameters (see augment.py), None for none,
+    drawn from augment_rng(*augment_key) (see generate_img_layout).
+    Returns False when the scene is discarded because something falls outside the canvas.
+    """
+    # Normalized (RGBA, height clamped to 1000-1024) and cached across calls
+    width, height = get_background(backGroundImageFile).size
+
+    # Geometry only: bounds are checked before any sprite is touched
+    with instrumentation.stage('layout'):
+        placements, reason = plan_layout(blocks, blocks_dir, width, height, rng)
+    if placements is None:
+        instrumentation.count(f"rejected_{reason}")
+        instrumentation.count('scenes_aborted')
+        return False
+    return generate_img_layout(placements, backGroundImageFile, OutputImageFile, OutputYoloFile, blocks_dir=blocks_dir, rng=rng, augment=augment, augment_key=augment_key)
+
+def render_sample(placements, backGroundImageFile, blocks_dir="img_blocks", rng=random, backend='pil'):
+    """
+    Renders an already planned (and valid) layout and applies a random perspective.
+    Returns the RGBA image and its labels as a list of (class id, cx, cy, w, h), YOLO normalized.
+    The image is a PIL image with the 'pil' backend, an HxWx4 uint8 array with 'numpy'.
+    """
+    size = get_background(backGroundImageFile).size
+    layer = render_layer(placements, size, blocks_dir, backend)
+    return warp_layer(layer, placements, size, backGroundImageFile, rng, backend)
 
-        if 'direction' in b and (b['name']=='andar' or b['name']=='pegar' or b['name']=='pular'):
-            blckArrow = Image.open(os.path.join(blocks_dir, 'seta.png'))
-            bnewwidth=round(blckArrow.size[0]*blck_perc)
-            bnewheight=round(blckArrow.size[1]*blck_perc)
-            
-            arrowX=b['x']+64+(random.randint(-3,3))
-            arrowY=b['y']+(random.randint(-3,3))
-            
-            if arrowX < 0 or arrowY < 0 or (arrowX + bnewwidth) > width or (arrowY + bnewheight) > height:
-                return
+def render_layer(placements, size, blocks_dir="img_blocks", backend='pil'):
+    """
+    Draws the blocks of a layout planned on a canvas of `size`.
+    Returns (layer, origin): the transparent layer is only as large as the blocks themselves
+    (plus a margin) and `origin` is its top-left corner on the canvas.
+    With the 'numpy' backend the layer is a reused buffer, valid until the next render_layer.
+    """
+    x0, y0, x1, y1 = content_bounds(placements, size)
+    render = render_blocks_array if backend == 'numpy' else render_blocks_layer
+    return render(placements, blocks_dir, (x1 - x0, y1 - y0), origin=(x0, y0)), (x0, y0)
 
-            blckArrow=blckArrow.resize((bnewwidth,bnewheight),Image.LANCZOS)
-            
-            # Rotation and Class Assignment
-            dir_suffix = 'up' # default
-            if b['direction']=='up':
-                blckArrow=blckArrow.rotate(45*-1,expand=True,resample=Image.BICUBIC)
-                dir_suffix = 'up'
-            if b['direction']=='down':
-                blckArrow=blckArrow.rotate(45*3,expand=True,resample=Image.BICUBIC)
-                dir_suffix = 'down'
-            if b['direction']=='left':
-                blckArrow=blckArrow.rotate(45*1,expand=True,resample=Image.BICUBIC)
-                dir_suffix = 'left'
-            if b['direction']=='right':
-                blckArrow=blckArrow.rotate(45*5,expand=True,resample=Image.BICUBIC)
-                dir_suffix = 'right'
-            
-            blocks_layer.paste(blckArrow,  (arrowX,arrowY), mask=blckArrow)
-            
-            # Granular Arrow Class
-            arrow_class_name = f"seta_{dir_suffix}"
-            if arrow_class_name in dicObj:
-                objects_to_transform.append({
-                    'class': dicObj[arrow_class_name],
-                    'rect': (arrowX, arrowY, blckArrow.size[0], blckArrow.size[1])
-                })
-
-        if 'steps' in b:
-            if b['steps']>1 and b['steps']<10:
-                blckMove = Image.open(os.path.join(blocks_dir, str(b['steps'])+'.png'))
-                newwidth_move=round(blckMove.size[0]*blck_perc)
-                newheight_move=round(blckMove.size[1]*blck_perc)
-                stepX=b['x']+128-30+(random.randint(-3,3))
-                stepY=b['y']+random.randint(-3,3)
-                
-                if stepX < 0 or stepY < 0 or (stepX + newwidth_move) > width or (stepY + newheight_move) > height:
-                    return
-
-                blckMove=blckMove.resize((newwidth_move,newheight_move),Image.LANCZOS)
-                blocks_layer.paste(blckMove, (stepX,stepY), mask=blckMove)
-                
-                # Granular Number Class
-                digit_class_name = str(b['steps'])
-                if digit_class_name in dicObj:
-                    objects_to_transform.append({
-                        'class': dicObj[digit_class_name],
-                        'rect': (stepX, stepY, blckMove.size[0], blckMove.size[1])
-                    })
+def warp_layer(layer, placements, size, backGroundImageFile, rng=random, backend='pil'):
+    """
+    Applies a random perspective to a block layer (see render_layer) rendered for a canvas of
+    `size` and composites it onto the background. When the background has another size the
+    canvas is first scaled (keeping the aspect ratio) to fit it, so the same layer can be
+    reused on any background.
+    Returns the RGBA image and its labels as a list of (class id, cx, cy, w, h), YOLO normalized.
+    """
+    blocks_layer, (x0, y0) = layer
+    base_image = get_background(backGroundImageFile)
+    width, height = base_image.size
+
+    # Store objects to annotate: {'class': int, 'rect': [x, y, w, h]}
+    objects_to_transform = [p for p in placements if p['class'] is not None]
 
     # --- Perspective Transformation Step ---
     
@@ -278,7 +125,7 @@ def generate_img_blocks(blocks,backGroundImageFile,OutputImageFile,OutputYoloFil
     offset_range = width * 0.05 # 5% distortion max approx
     
     def rand_offset():
-        return random.uniform(-offset_range, offset_range)
+        return rng.uniform(-offset_range, offset_range)
     
     dst_points = [
         (0 + rand_offset(), 0 + rand_offset()),           # Top-left
@@ -287,68 +134,69 @@ def generate_img_blocks(blocks,backGroundImageFile,OutputImageFile,OutputYoloFil
         (0 + rand_offset(), height + rand_offset())       # Bottom-left
     ]
     
-    # 3. Calculate Coefficients for PIL (Backward Mapping: Dest -> Source)
-    # PIL transform data expects coeffs to map (x_dest, y_dest) -> (x_src, y_src)
-    pil_coeffs = find_coeffs(dst_points, src_points)
-    
-    # 4. Transform the blocks layer
-    transformed_layer = blocks_layer.transform((width, height), Image.PERSPECTIVE, pil_coeffs, Image.BICUBIC)
+    # 3. Calculate Coefficients: forward (Source -> Dest) for the annotations and
+    # backward (Dest -> Source) for PIL, whose transform maps (x_dest, y_dest) -> (x_src, y_src)
+    fwd_coeffs, pil_coeffs = solve_homography(src_points, dst_points)
+    if size != (width, height):
+        # Layer canvas -> this background, then the perspective
+        s = min(width / size[0], height / size[1])
+        fwd_coeffs = compose_coeffs(scale_coeffs(s), fwd_coeffs)
+        pil_coeffs = compose_coeffs(pil_coeffs, scale_coeffs(1 / s))
     
-    # 5. Composite onto background
-    # Ensure background is RGBA for alpha composite, then convert back if needed, or just paste with mask
-    # alpha_composite requires both to be RGBA
-    final_image = Image.alpha_composite(base_image, transformed_layer)
+    # 4. Transform the blocks layer and 5. Composite onto background
+    # Both restricted to the region the blocks land on, the rest of the frame is left untouched
+    if backend == 'numpy':
+        final_image = warp_array_onto(get_background_array(backGroundImageFile), blocks_layer, (x0, y0), fwd_coeffs, pil_coeffs)
+    else:
+        final_image = warp_onto(base_image, blocks_layer, (x0, y0), fwd_coeffs, pil_coeffs)
     
     # 6. Transform Annotations (Box Coordinates)
-    # We need Forward Mapping coefficients: Source -> Dest
-    fwd_coeffs = find_coeffs(src_points, dst_points)
-    
-    yolo_annotation = ""
-    
-    for obj in objects_to_transform:
-        x, y, w, h = obj['rect']
-        # Get the 4 corners of the bbox
-        corners = [
-            (x, y),
-            (x + w, y),
-            (x + w, y + h),
-            (x, y + h)
-        ]
-        
-        # Transform all 4 corners
-        tx_corners = [transform_point(p, fwd_coeffs) for p in corners]
-        
-        # Find new bounding box (AABB) enclosing the transformed corners
-        xs = [p[0] for p in tx_corners]
-        ys = [p[1] for p in tx_corners]
-        
-        min_x, max_x = min(xs), max(xs)
-        min_y, max_y = min(ys), max(ys)
-        
-        # Clip to image boundaries
-        min_x = max(0, min_x)
-        min_y = max(0, min_y)
-        max_x = min(width, max_x)
-        max_y = min(height, max_y)
-        
-        # Calculate YOLO format: center_x, center_y, width, height (normalized)
-        bw = max_x - min_x
-        bh = max_y - min_y
-        
-        if bw <= 0 or bh <= 0:
-            continue
+    # All bbox corners are transformed at once, then enclosed (AABB) and clipped to the image
+    labels = []
+    with instrumentation.stage('annotate'):
+        if objects_to_transform:
+            rects = [obj['rect'] for obj in objects_to_transform]
+            boxes = transform_boxes(rects, fwd_coeffs, width, height)
+            yolo_boxes, valid = boxes_to_yolo(boxes, width, height)
             
-        cx = min_x + bw / 2.0
-        cy = min_y + bh / 2.0
-        
-        yolo_annotation += f"{obj['class']} {cx/width:.6f} {cy/height:.6f} {bw/width:.6f} {bh/height:.6f}\n"
+            for obj, (cx, cy, bw, bh), ok in zip(objects_to_transform, yolo_boxes.tolist(), valid.tolist()):
+                if not ok:
+                    instrumentation.count('bboxes_dropped')
+                    continue
+                instrumentation.count_class(CLASS_LIST[obj['class']])
+                labels.append((obj['class'], cx, cy, bw, bh))
+
+    return final_image, labels
+
+def format_yolo(labels):
+    return "".join(f"{c} {cx:.6f} {cy:.6f} {bw:.6f} {bh:.6f}\n" for c, cx, cy, bw, bh in labels)
+
+def generate_img_layout(placements,backGroundImageFile,OutputImageFile,OutputYoloFile, blocks_dir="img_blocks", rng=random, writer=None, augment=None, augment_key=None):
+    """
+    Renders an already planned (and valid) layout, applies a random perspective and writes the image and its YOLO labels.
+    With a writer (writer.SampleWriter) encoding and writing happen in its thread pool.
+    The augmentation is drawn from augment_rng(*augment_key), (seed, index[, copy]) as in
+    generate_unit, by default (0, output file name): never from the layout rng.
+    """
+    final_image, labels = render_sample(placements, backGroundImageFile, blocks_dir=blocks_dir, rng=rng)
+    if augment:
+        if augment_key is None:
+            augment_key = (0, os.path.splitext(os.path.basename(OutputImageFile))[0])
+        final_image = augment_image(final_image, augment, augment_rng(*augment_key))
+    yolo_annotation = format_yolo(labels)
+
+    if writer is not None:
+        writer.submit(final_image, OutputImageFile, OutputYoloFile, yolo_annotation)
+        return True
 
     _traintxtfile = open(OutputYoloFile, "w+", newline="\n")
     _traintxtfile.write(yolo_annotation)
     _traintxtfile.close()
 
     #transparent.show() # Disabled for headless run
-    final_image.save(OutputImageFile)
+    with instrumentation.stage('encode'):
+        final_image.save(OutputImageFile)
+    return True
 
 
 def add_with_transparency(input_image_path,
@@ -392,29 +240,634 @@ def add_with_transparency(input_image_path,
     transparent.show()
     transparent.save(output_image_path)
 
-if __name__ == '__main__':
+DEFAULT_BLOCK_DIRS = ['img_blocks'] + [f'img_blocks_p{i}' for i in range(1, 9)]
 
-    dirimg="./bg/"
-    dirsets="./sets/"
-    diroutput="../yolo_model/data/obj/"
-    loops=1000
-    
-    available_block_dirs = ['img_blocks'] + [f'img_blocks_p{i}' for i in range(1, 9)]
+# Part of the key of every generated sample (see unit_key): bump it when a change to the
+# generator changes its output, so incremental runs regenerate everything
+GENERATOR_VERSION = 1
 
-    for x in range(loops):
-        for bgFile in os.listdir(dirimg):
-            # Pick a random block directory for this image
-            current_blocks_dir = random.choice(available_block_dirs)
-            print(f"Generating image {x}, using blocks from: {current_blocks_dir}")
-            
-            for setFile in os.listdir(dirsets):
-                if setFile.endswith(".txt"):
-                    timestampStr = datetime.now().strftime("%Y%m%d%H%M%S%f")
-                    tmpFile=timestampStr+"_"+ setFile.split('.')[0]
-                    tmpBlocks=proc_txt_file('sets/'+setFile)
-                    generate_img_blocks(tmpBlocks,dirimg+bgFile,diroutput+tmpFile+".png",diroutput+tmpFile+".txt", blocks_dir=current_blocks_dir)
+# Scenes in a row without any image written before a run with --images gives up
+MAX_EMPTY_UNITS = 2000
+
+# Settings of the current run, the sample writer and the label index writer, set in every worker by _init_worker
+_run_config = None
+_writer = None
+_label_index = None
 
 
+def list_work(dirimg, dirsets):
+    """
+    Sorted background and set file names, so work unit indexes are stable across runs.
+    """
+    bg_files = sorted(os.listdir(dirimg))
+    set_files = sorted(f for f in os.listdir(dirsets) if f.endswith(".txt"))
+    return bg_files, set_files
+
+
+def make_config(seed, dirimg="./bg/", dirsets="./sets/", diroutput="../yolo_model/data/obj/", block_dirs=None,
+                max_layout_attempts=MAX_LAYOUT_ATTEMPTS, bg_cache=None, shards=None, writer=None, stats=False,
+                label_index=True, fanout=1, backend='pil', augment=None, incremental=False, resolutions=None):
+    """
+    Settings of a run, as used by plan_unit/generate_unit and run_generation.
+    `shards` is the number of samples per shard (None writes loose files), `writer` the
+    keyword arguments of writer.SampleWriter and `stats` turns on instrumentation.py.
+    With `label_index` the labels of every sample are also appended to the columnar index
+    in <diroutput>/label_index (see labelindex.py). `fanout` is the number of backgrounds
+    every rendered block layer is composited onto (see generate_unit) and `backend` the
+    compositing backend (see compositing.BACKENDS). `augment` are the photometric
+    augmentation parameters applied to every sample (see augment.py), None for none.
+    With `incremental`, units whose inputs did not change since the last run into the same
+    output are skipped (see manifest.py and run_generation). `resolutions` are longest sides
+    every image is also written at, each in its own root (see resolution_dirs).
+    """
+    bg_files, set_files = list_work(dirimg, dirsets)
+    return {
+        'seed': seed,
+        'dirimg': dirimg,
+        'dirsets': dirsets,
+        'diroutput': diroutput,
+        'bg_files': bg_files,
+        'set_files': set_files,
+        'block_dirs': list(block_dirs or DEFAULT_BLOCK_DIRS),
+        'bg_cache': bg_cache,
+        'max_layout_attempts': max_layout_attempts,
+        'shards': shards,
+        'stats': stats,
+        'label_index': label_index,
+        'fanout': fanout,
+        'backend': backend,
+        'augment': dict(augment) if augment else None,
+        'incremental': incremental,
+        'resolutions': sorted(set(resolutions or []), reverse=True),
+        # Names the shards and index parts of this run, so a later run into the same output adds files
+        'run_id': time.strftime('%Y%m%d%H%M%S'),
+        'writer': dict(writer or {})
+    }
+
+
+def resolution_dirs(config):
+    """
+    (max_side, directory) of the extra resolutions, with the same image and label file names.
+    Each one is a dataset root of its own: for the usual <root>/data/obj output it is
+    <root>_<max_side>/data/obj, ready for yolo_model/data_utils.prepare_dataset. Any other
+    output goes to <diroutput>_<max_side>.
+    """
+    output = os.path.normpath(config['diroutput'])
+    data_dir, obj = os.path.split(output)
+    root, data = os.path.split(data_dir)
+    if data == 'data':
+        return [(size, os.path.join(f"{root}_{size}", data, obj)) for size in config.get('resolutions') or []]
+    return [(size, f"{output}_{size}") for size in config.get('resolutions') or []]
+
+
+def prepare_resolution_roots(config):
+    """
+    Creates the extra resolution dirs, with a copy of the class names file (obj.names next
+    to diroutput) in each dataset root.
+    """
+    names_file = os.path.join(os.path.dirname(os.path.normpath(config['diroutput'])), 'obj.names')
+    for _, directory in resolution_dirs(config):
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(names_file):
+            shutil.copyfile(names_file, os.path.join(os.path.dirname(directory), 'obj.names'))
+
+
+def work_unit(index, bg_files, set_files):
+    """
+    Maps a global unit index to its (loop, background, set file).
+    Units walk sets first, then backgrounds, then loops, like the original nested loops.
+    """
+    per_loop = len(bg_files) * len(set_files)
+    loop = index // per_loop
+    bgFile = bg_files[(index // len(set_files)) % len(bg_files)]
+    setFile = set_files[index % len(set_files)]
+    return loop, bgFile, setFile
+
+
+def sample_id(seed, index, setFile, copy=0):
+    """
+    Deterministic and collision-free name for the sample of a work unit
+    (`copy` > 0 for the extra backgrounds of a fan-out, see generate_unit).
+    """
+    if copy:
+        return f"{seed}_{index:09d}-{copy}_{setFile.split('.')[0]}"
+    return f"{seed}_{index:09d}_{setFile.split('.')[0]}"
+
+
+def unit_rng(seed, index):
+    """
+    Independent RNG per work unit: the output of a unit does not depend on
+    which worker runs it nor on how many workers there are.
+    """
+    return random.Random(f"{seed}:{index}")
+
+
+def input_digests(config):
+    """
+    Digests of everything the output of a run depends on besides the unit index: the
+    settings that change pixels or files, and the contents of every background, set file
+    and blocks dir. Computed once per run, by the parent process.
+    """
+    writer = config.get('writer', {})
+    settings = {
+        'version': GENERATOR_VERSION,
+        'seed': config['seed'],
+        'max_layout_attempts': config['max_layout_attempts'],
+        'block_dirs': config['block_dirs'],
+        'augment': config.get('augment'),
+        'format': [writer.get(k) for k in ('image_format', 'quality', 'compress_level', 'rgb')],
+    }
+    digests = {
+        'settings': hashlib.sha1(repr(sorted(settings.items())).encode()).hexdigest(),
+        'bg': {f: file_digest(os.path.join(config['dirimg'], f)) for f in config['bg_files']},
+        'sets': {f: file_digest(os.path.join(config['dirsets'], f)) for f in config['set_files']},
+        'blocks': {d: blocks_digest(d) for d in config['block_dirs']},
+    }
+    # Fan-out copies may land on any background
+    digests['all_bg'] = hashlib.sha1(repr(sorted(digests['bg'].items())).encode()).hexdigest()
+    return digests
+
+
+def unit_key(index, config, digests, fanout=1):
+    """
+    Content hash of a work unit: same key, same samples. Covers the set file, background and
+    blocks dir of the unit (names and contents), the seed, the generator version and settings
+    (see input_digests), and the fan-out it was generated with.
+    """
+    loop, bgFile, setFile = work_unit(index, config['bg_files'], config['set_files'])
+    blocks_dir = unit_rng(config['seed'], index).choice(config['block_dirs'])
+    parts = [digests['settings'], str(index), str(fanout),
+             bgFile, digests['bg'][bgFile], setFile, digests['sets'][setFile],
+             blocks_dir, digests['blocks'][blocks_dir]]
+    if fanout > 1:
+        parts.append(digests['all_bg'])
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+
+def _init_worker(config):
+    global _run_config, _writer, _label_index
+    _run_config = config
+    if config.get('bg_cache'):
+        set_background_cache(BackgroundCache(cache_dir=config['bg_cache']))
+        set_atlas_cache_dir(config['bg_cache'])
+    # Shards and index parts are named after the run and the process, so workers never share a file
+    process_name = f"{config['seed']}-{config.get('run_id', '0')}-{multiprocessing.current_process().name.lower()}"
+    sink = None
+    if config.get('shards'):
+        sink = ShardWriter(config['diroutput'], f"shard-{process_name}", config['shards'])
+    _writer = SampleWriter(sink=sink, resolutions=resolution_dirs(config), **config.get('writer', {}))
+    _label_index = None
+    if config.get('label_index'):
+        _label_index = LabelIndexWriter(os.path.join(config['diroutput'], LABEL_INDEX_DIR), f"labels-{process_name}")
+    if multiprocessing.parent_process() is not None:
+        # Pool workers have no shutdown hook of their own, drain the writers when the process exits
+        multiprocessing.util.Finalize(_writer, _close_worker_writer, args=(config.get('errors_dir'),), exitpriority=10)
+        if _label_index is not None:
+            multiprocessing.util.Finalize(_label_index, _label_index.close, exitpriority=10)
+        if config.get('stats_dir'):
+            # Runs after the writer is drained (lower priority), so encode times are included
+            instrumentation.enable()
+            stats_path = os.path.join(config['stats_dir'], f"{os.getpid()}.json")
+            multiprocessing.util.Finalize(None, instrumentation.get_stats().dump, args=(stats_path,), exitpriority=5)
+
+
+def _close_worker_writer(errors_dir):
+    # Exceptions raised at process exit are dropped, leave them in errors_dir for the parent
+    try:
+        _writer.close()
+    except Exception as e:
+        if errors_dir is None:
+            raise
+        with open(os.path.join(errors_dir, f"{os.getpid()}.txt"), 'w') as f:
+            f.write(f"{type(e).__name__}: {e}\n")
+
+
+def _worker_errors(errors_dir):
+    errors = []
+    for name in sorted(os.listdir(errors_dir)):
+        with open(os.path.join(errors_dir, name)) as f:
+            errors.append(f.read().strip())
+    return errors
+
+
+def plan_unit(index, config, plan=None):
+    """
+    Picks the background, set file and blocks dir of a work unit and plans its layout.
+    Invalid layouts are resampled up to max_layout_attempts times before any pixel work.
+    A `plan` from scheduler.ClassBalancedScheduler replaces the background and set file of
+    the unit and biases the layouts towards the classes it needs.
+    Returns a dict with bg_path, set_file, blocks_dir, placements (None if every attempt
+    was rejected), rejects (reasons of the discarded layouts) and the unit rng.
+    """
+    if plan is None:
+        loop, bgFile, setFile = work_unit(index, config['bg_files'], config['set_files'])
+        bias = None
+    else:
+        bgFile, setFile, bias = plan['bg_file'], plan['set_file'], plan.get('bias')
+    rng = unit_rng(config['seed'], index)
+    blocks_dir = rng.choice(config['block_dirs'])
+    bg_path = os.path.join(config['dirimg'], bgFile)
+
+    width, height = get_background(bg_path).size
+    sampler = compile_set_file(os.path.join(config['dirsets'], setFile))
+    placements, rejects = plan_scene(sampler, blocks_dir, width, height, rng, config['max_layout_attempts'], bias)
+    return {
+        'bg_path': bg_path,
+        'set_file': setFile,
+        'blocks_dir': blocks_dir,
+        'placements': placements,
+        'rejects': rejects,
+        'rng': rng
+    }
+
+
+def fanout_backgrounds(bg_path, config, rng, count):
+    """
+    `count` other backgrounds, drawn without replacement, for the fan-out copies of a unit.
+    """
+    others = [f for f in config['bg_files'] if f != os.path.basename(bg_path)]
+    return [os.path.join(config['dirimg'], f) for f in rng.sample(others, min(count, len(others)))]
+
+
+def _write_sample(config, name, final_image, labels, bg_path, setFile, blocks_dir):
+    _writer.submit(final_image,
+                   os.path.join(config['diroutput'], name + _writer.extension),
+                   os.path.join(config['diroutput'], name + ".txt"),
+                   format_yolo(labels))
+    if _label_index is not None:
+        _label_index.add(name, labels, _writer.extension, background=os.path.basename(bg_path),
+                         set_file=setFile, blocks_dir=os.path.basename(os.path.normpath(blocks_dir)))
+
+
+def generate_unit(index, fanout=None, plan=None):
+    """
+    Generates the sample of one work unit (with the background and set file of `plan`
+    when given, see plan_unit).
+    With a fan-out of K (config['fanout'] unless given), the rendered block layer is also
+    warped onto K - 1 other backgrounds, each with its own perspective and labels.
+    Returns {'index': index, 'set': set file, 'background': background file, 'ok': True if
+    an image was written, 'images': images written, 'samples': their sample ids,
+    'classes': boxes written per class name, 'rejects': reasons of the discarded layouts}.
+    Raises the errors of the samples this process finished writing since the last unit.
+    """
+    config = _run_config
+    _writer.raise_errors()
+    fanout = fanout or config.get('fanout', 1)
+    unit = plan_unit(index, config, plan)
+    setFile = unit['set_file']
+    rejects = unit['rejects']
+    placements = unit['placements']
+    result = {'index': index, 'set': setFile, 'background': os.path.basename(unit['bg_path']),
+              'ok': False, 'images': 0, 'samples': [], 'classes': Counter(), 'rejects': rejects}
+    if placements is None:
+        return result
+
+    bg_path = unit['bg_path']
+    blocks_dir = unit['blocks_dir']
+    rng = unit['rng']
+    size = get_background(bg_path).size
+    backend = config.get('backend', 'pil')
+    layer = render_layer(placements, size, blocks_dir, backend)
+    final_image, labels = warp_layer(layer, placements, size, bg_path, rng, backend)
+    if config.get('augment'):
+        final_image = augment_image(final_image, config['augment'], augment_rng(config['seed'], index))
+    samples = [sample_id(config['seed'], index, setFile)]
+    _write_sample(config, samples[0], final_image, labels, bg_path, setFile, blocks_dir)
+    result['classes'].update(CLASS_LIST[label[0]] for label in labels)
+
+    copies = fanout_backgrounds(bg_path, config, rng, fanout - 1) if fanout > 1 else []
+    for copy, other_bg in enumerate(copies, 1):
+        final_image, labels = warp_layer(layer, placements, size, other_bg, rng, backend)
+        if config.get('augment'):
+            final_image = augment_image(final_image, config['augment'], augment_rng(config['seed'], index, copy))
+        samples.append(sample_id(config['seed'], index, setFile, copy))
+        _write_sample(config, samples[-1], final_image, labels, other_bg, setFile, blocks_dir)
+        result['classes'].update(CLASS_LIST[label[0]] for label in labels)
+    _writer.raise_errors()
+    result.update(ok=True, images=len(samples), samples=samples)
+    return result
+
+
+def _generate_planned(item, fanout=None):
+    index, plan = item
+    return generate_unit(index, fanout, plan)
+
+
+class IncrementalRun:
+    """
+    State of an incremental run: the manifest of the output directory, the input digests
+    and the units covered by this run. Units whose key and files are unchanged are skipped,
+    regenerated units replace their manifest entry and lose their stale samples.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.directory = config['diroutput']
+        # Samples are removed from the extra resolution roots too
+        self.directories = [self.directory] + [d for _, d in resolution_dirs(config)]
+        self.ext = IMAGE_FORMATS[config.get('writer', {}).get('image_format', 'png')][1]
+        self.manifest = Manifest.load(os.path.join(self.directory, MANIFEST_NAME))
+        self.digests = input_digests(config)
+        self.keys = {}
+        self.skipped = 0
+        self.removed = set()
+
+    def _files_exist(self, entry):
+        # An interrupted run records units whose files were still queued in the writers
+        return all(os.path.exists(os.path.join(d, s + ext)) for d in self.directories for s in entry['samples']
+                   for ext in (entry['ext'], '.txt'))
+
+    def _remove(self, sample_ids, ext):
+        for directory in self.directories:
+            remove_samples(directory, sample_ids, ext)
+        self.removed.update(sample_ids)
+
+    def select(self, indexes, fanout=1):
+        """
+        Splits `indexes` into (units to generate, images of the up to date units).
+        """
+        todo = []
+        images = 0
+        for index in indexes:
+            key = self.keys[index] = unit_key(index, self.config, self.digests, fanout)
+            if self.manifest.is_current(index, key, self.ext) and self._files_exist(self.manifest.get(index)):
+                images += len(self.manifest.get(index)['samples'])
+                self.skipped += 1
+            else:
+                todo.append(index)
+        return todo, images
+
+    def record(self, result):
+        index = result['index']
+        old = self.manifest.get(index)
+        if old is not None:
+            self._remove(set(old['samples']) - set(result['samples']), old['ext'])
+        self.manifest.set(index, self.keys[index], result['samples'], self.ext)
+
+    def collect_garbage(self):
+        """
+        Deletes the samples and entries of every unit this run did not cover.
+        """
+        for index in [i for i in self.manifest.units if i not in self.keys]:
+            entry = self.manifest.remove(index)
+            self._remove(entry['samples'], entry['ext'])
+
+    def finish(self):
+        self.manifest.save()
+        index_dir = os.path.join(self.directory, LABEL_INDEX_DIR)
+        if self.removed and self.config.get('label_index') and os.path.isdir(index_dir):
+            # Drop the labels of the deleted samples from the index
+            prune_label_index(index_dir, self.removed, f"labels-{self.config['seed']}-{self.config['run_id']}-pruned.npz")
+        print(f"Incremental: {self.skipped} units up to date, {len(self.removed)} stale samples removed")
+
+
+def _run_units(indexes, pool, layout_stats, fanout=None, incremental=None, plans=None, scheduler=None,
+               on_progress=None):
+    # on_progress(units done, images) is called after every unit, skipped ones count as done
+    skipped_images = 0
+    units = len(indexes)
+    if incremental is not None:
+        indexes, skipped_images = incremental.select(indexes, fanout or incremental.config.get('fanout', 1))
+    work = generate_unit if plans is None else _generate_planned
+    if plans is not None:
+        indexes = [(index, plans[index]) for index in indexes]
+    if fanout is not None:
+        work = functools.partial(work, fanout=fanout)
+    if pool is None:
+        results = map(work, indexes)
+    else:
+        # Scheduler batches are small: one unit per task keeps every worker busy
+        results = pool.imap_unordered(work, indexes, chunksize=8 if plans is None else 1)
+    generated = skipped_images
+    done = units - len(indexes)
+    for result in results:
+        layout_stats.add(result['set'], result['rejects'], result['ok'])
+        generated += result['images']
+        if incremental is not None:
+            incremental.record(result)
+        if scheduler is not None:
+            scheduler.add(result)
+        done += 1
+        if on_progress is not None:
+            on_progress(done, generated)
+    return generated
+
+
+def run_generation(config, workers=1, images=None, loops=1000, layout_stats=None, gc=False,
+                   quotas=None, bias_strength=BIAS_STRENGTH):
+    """
+    Runs the generation over a pool of `workers` processes (in-process when workers == 1).
+
+    Without `images`, every (loop, background, set) unit of `loops` loops is generated once.
+    With `images`, units keep being scheduled until that many images were written
+    (scenes discarded for falling outside the canvas are not counted).
+    Layout rejections per set file are added to `layout_stats` (a layout.LayoutStats)
+    and printed at the end.
+    With config['stats'], stage timings and counters of every process are merged into
+    instrumentation.get_stats() and printed at the end too.
+
+    With config['incremental'], the manifest of the output directory (manifest.py) records
+    the key and samples of every unit: units with an unchanged key are skipped (their images
+    still count), changed ones are regenerated. With `gc`, the samples of units outside this
+    run (e.g. from a run with more images) are deleted too.
+
+    With `quotas` (class name -> boxes, see scheduler.py), units are planned by a
+    ClassBalancedScheduler until every quota is met (or `images` were written, if given).
+    """
+    if layout_stats is None:
+        layout_stats = LayoutStats()
+    os.makedirs(config['diroutput'], exist_ok=True)
+    prepare_resolution_roots(config)
+    incremental = None
+    if config.get('incremental'):
+        if config.get('shards'):
+            raise ValueError("Incremental runs need loose files, they can not be used with shards")
+        incremental = IncrementalRun(config)
+    scheduler = None
+    if quotas:
+        if incremental is not None:
+            raise ValueError("Class quotas can not be used with incremental runs, units are planned from the results of the run")
+        scheduler = ClassBalancedScheduler(quotas, config, bias_strength)
+    per_loop = len(config['bg_files']) * len(config['set_files'])
+
+    stats = None
+    if config.get('stats'):
+        stats = instrumentation.enable()
+        if workers > 1:
+            # Workers dump their stats here when they exit
+            config = dict(config, stats_dir=tempfile.mkdtemp(prefix='ory-stats-'))
+
+    pool = None
+    worker_errors = []
+    if workers > 1:
+        # Workers leave here the write errors of their last samples, found when they exit
+        config = dict(config, errors_dir=tempfile.mkdtemp(prefix='ory-errors-'))
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(config,))
+    else:
+        _init_worker(config)
+        # Decode and normalize every background once, they are reused by every loop
+        get_background_cache().preload([os.path.join(config['dirimg'], f) for f in config['bg_files']])
+
+    generated = 0
+    completed = False
+    try:
+        if scheduler is not None:
+            next_index = 0
+            fanout = config.get('fanout', 1)
+            stalled = 0
+            while not scheduler.done() and (images is None or generated < images):
+                if stalled >= MAX_STALLED_UNITS:
+                    # e.g. the only sets producing a class never fit the canvas
+                    unmet = ", ".join(f"{c} ({scheduler.counts[c]}/{q})" for c, q in scheduler.quotas.items()
+                                      if c in scheduler.deficits())
+                    print(f"Stopping: {stalled} scenes in a row added no box towards the quotas. Not met: {unmet}")
+                    break
+                before = scheduler.deficits()
+                max_units = BATCH_UNITS if images is None else max(1, min(BATCH_UNITS, (images - generated) // fanout))
+                units = scheduler.plan(max_units, fanout)
+                if not units:
+                    break
+                plans = dict(enumerate(units, next_index))
+                generated += _run_units(sorted(plans), pool, layout_stats, plans=plans, scheduler=scheduler)
+                next_index += len(units)
+                stalled = stalled + len(units) if scheduler.deficits() == before else 0
+                missing = sum(scheduler.deficits().values())
+                print(f"{generated} images ({next_index} scenes sampled), {missing} boxes missing from the quotas")
+            print("\nClass quotas:")
+            print(scheduler.summary())
+        elif images is None:
+            # A single stream of units, so the pool never drains between loops
+            loops_done = [0]
+
+            def loop_progress(done, generated):
+                if done // per_loop > loops_done[0]:
+                    loops_done[0] = done // per_loop
+                    print(f"Loop {loops_done[0]}/{loops}: {generated} images")
+
+            generated = _run_units(range(loops * per_loop), pool, layout_stats, incremental=incremental,
+                                   on_progress=loop_progress)
+        else:
+            next_index = 0
+            fanout = config.get('fanout', 1)
+            empty = 0
+            while generated < images:
+                if empty >= MAX_EMPTY_UNITS:
+                    print(f"Stopping: no image written in the last {empty} scenes, every layout is rejected "
+                          f"(see the layout rejections below and --max-layout-attempts)")
+                    break
+                # Never schedule more images than missing, so the count is exact
+                missing = images - generated
+                batch = max(1, missing // fanout)
+                written = _run_units(range(next_index, next_index + batch), pool, layout_stats,
+                                     fanout=min(fanout, missing), incremental=incremental)
+                generated += written
+                empty = 0 if written else empty + batch
+                next_index += batch
+                print(f"{generated}/{images} images ({next_index} scenes sampled)")
+        if incremental is not None and gc:
+            incremental.collect_garbage()
+        completed = True
+    finally:
+        if pool is not None:
+            if completed:
+                pool.close()
+            else:
+                # Interrupted or failed: drop the queued units instead of generating them all
+                pool.terminate()
+            pool.join()
+            worker_errors = _worker_errors(config['errors_dir'])
+            shutil.rmtree(config['errors_dir'], ignore_errors=True)
+        else:
+            if _writer is not None:
+                _writer.close()
+            if _label_index is not None:
+                _label_index.close()
+        if incremental is not None:
+            # Saved even when interrupted, so the next run resumes from the units already written
+            # (units whose queued images or labels died with the workers fail select's file check)
+            incremental.finish()
+        print("\nLayout rejections per set file:")
+        print(layout_stats.summary())
+        if stats is not None:
+            if config.get('stats_dir'):
+                instrumentation.merge_dumps(stats, config['stats_dir'])
+                shutil.rmtree(config['stats_dir'], ignore_errors=True)
+            print("\nGenerator stages:")
+            print(stats.summary())
+    if worker_errors:
+        raise RuntimeError(f"Writing samples failed in {len(worker_errors)} worker(s): {worker_errors[0]}")
+    return generated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate the artificial YOLO dataset of Ory blocks.")
+    parser.add_argument("--workers", "-w", type=int, default=1, help="Number of generator processes.")
+    parser.add_argument("--images", "-n", type=int, help="Total number of images to generate. Default: every (loop, background, set).")
+    parser.add_argument("--loops", type=int, default=1000, help="Loops over all backgrounds and sets when --images is not given.")
+    parser.add_argument("--seed", type=int, help="Base seed. Same seed, same dataset. Default: random.")
+    parser.add_argument("--bg-dir", default="./bg/", help="Backgrounds directory.")
+    parser.add_argument("--sets-dir", default="./sets/", help="Set files directory.")
+    parser.add_argument("--output", "-o", default="../yolo_model/data/obj/", help="Output directory.")
+    parser.add_argument("--blocks-dirs", default=",".join(DEFAULT_BLOCK_DIRS), help="Comma separated block sprite directories or collection atlases (.png built by scripts/generate_collection_image.py, see sprites.py).")
+    parser.add_argument("--fanout", type=int, default=1, help="Backgrounds each rendered block layer is composited onto, with independent perspectives.")
+    parser.add_argument("--max-layout-attempts", type=int, default=MAX_LAYOUT_ATTEMPTS, help="Layouts sampled per scene before giving up when they fall outside the canvas.")
+    parser.add_argument("--backend", choices=BACKENDS, default="pil", help="Compositing backend: PIL images or NumPy arrays in reused buffers (same output).")
+    parser.add_argument("--augment", choices=sorted(AUGMENT_PRESETS), default="none", help="Photometric augmentation preset (lighting, color cast, shadows, blur, noise, JPEG artifacts, see augment.py).")
+    parser.add_argument("--augment-params", help="JSON object or JSON file overriding augmentation preset values, e.g. '{\"noise_p\": 0}'.")
+    parser.add_argument("--format", choices=sorted(IMAGE_FORMATS), default="png", help="Output image format.")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG/WebP quality.")
+    parser.add_argument("--compress-level", type=int, default=6, help="PNG compression level (0-9). Lower is faster and bigger.")
+    parser.add_argument("--rgb", action="store_true", help="Save RGB instead of RGBA (the alpha channel is not used for training).")
+    parser.add_argument("--writer-threads", type=int, default=2, help="Encoder threads per generator process.")
+    parser.add_argument("--writer-queue", type=int, default=16, help="Images waiting to be encoded before rendering blocks.")
+    parser.add_argument("--resolutions", help="Comma separated longest sides (e.g. 640,320) every image is also written at, scaled down from the same render with the same labels. Each size is its own dataset root: ../yolo_model_<size>/data/obj for the default output, <output>_<size> otherwise.")
+    parser.add_argument("--shards", action="store_true", help="Write tar shards with an index into the output directory instead of loose files (see shards.py).")
+    parser.add_argument("--samples-per-shard", type=int, default=SAMPLES_PER_SHARD, help="Samples per shard with --shards.")
+    parser.add_argument("--stats", action="store_true", help="Print the time spent per generator stage, discarded scenes, dropped boxes and boxes per class.")
+    parser.add_argument("--no-label-index", action="store_true", help="Do not keep the columnar label index (<output>/label_index, see labelindex.py).")
+    parser.add_argument("--quotas", help="Per class box targets, e.g. 'zzz=2000,seta_left=1500' (or a JSON object or file): units are planned to reach them with as few images as possible, --images becomes a maximum (see scheduler.py).")
+    parser.add_argument("--bias-strength", type=float, default=BIAS_STRENGTH, help="With --quotas, how strongly the random choices of set files are biased towards missing classes.")
+    parser.add_argument("--incremental", action="store_true", help="Skip the samples whose inputs (set file, background, blocks dir, seed, settings) did not change since the last incremental run into --output (<output>/manifest.json).")
+    parser.add_argument("--gc", action="store_true", help="With --incremental, delete the samples of previous runs that are not part of this one.")
+    parser.add_argument("--bg-cache", help="Directory to keep normalized backgrounds and decoded sprite atlases as raw RGBA frames between runs.")
+    args = parser.parse_args()
+    if args.incremental and args.seed is None:
+        parser.error("--incremental needs --seed, samples are only reused for the same seed")
+    if args.gc and not args.incremental:
+        parser.error("--gc needs --incremental")
+    if args.resolutions and args.shards:
+        parser.error("--resolutions writes loose files, it can not be used with --shards")
+    if args.quotas and args.incremental:
+        parser.error("--quotas can not be used with --incremental")
+
+    seed = args.seed if args.seed is not None else random.randrange(1 << 32)
+    print(f"Seed: {seed}")
+
+    config = make_config(
+        seed, args.bg_dir, args.sets_dir, args.output,
+        block_dirs=args.blocks_dirs.split(','),
+        max_layout_attempts=args.max_layout_attempts,
+        bg_cache=args.bg_cache,
+        shards=args.samples_per_shard if args.shards else None,
+        stats=args.stats,
+        label_index=not args.no_label_index,
+        fanout=args.fanout,
+        backend=args.backend,
+        augment=load_augment_params(args.augment, args.augment_params),
+        incremental=args.incremental,
+        resolutions=[int(r) for r in args.resolutions.split(',')] if args.resolutions else None,
+        writer={
+            'image_format': args.format,
+            'quality': args.quality,
+            'compress_level': args.compress_level,
+            'rgb': args.rgb,
+            'threads': args.writer_threads,
+            'queue_size': args.writer_queue
+        }
+    )
+    run_generation(config, workers=args.workers, images=args.images, loops=args.loops, gc=args.gc,
+                   quotas=parse_quotas(args.quotas) if args.quotas else None, bias_strength=args.bias_strength)
+
     #_blocks=proc_txt_file('sets/setrnd.txt')
     #generate_img_blocks(_blocks,"bg/desk2.jpg","/data/datasets/ludico/data/obj/output1.png","/data/datasets/ludico/data/obj/output1.txt")
     #_blocks=proc_txt_file('sets/set4.txt')
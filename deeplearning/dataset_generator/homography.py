@@ -0,0 +1,144 @@
+import numpy as np
+
+# Perspective coefficients follow PIL's Image.PERSPECTIVE convention: 8 values (a, b, c, d, e, f, g, h)
+#   x' = (a*x + b*y + c) / (g*x + h*y + 1)
+#   y' = (d*x + e*y + f) / (g*x + h*y + 1)
+
+
+def coeffs_to_matrix(coeffs):
+    """
+    (..., 8) coefficients -> (..., 3, 3) homography matrices.
+    """
+    coeffs = np.asarray(coeffs, dtype=np.float64)
+    ones = np.ones(coeffs.shape[:-1] + (1,))
+    return np.concatenate([coeffs, ones], axis=-1).reshape(coeffs.shape[:-1] + (3, 3))
+
+
+def matrix_to_coeffs(matrix):
+    """
+    (..., 3, 3) homography matrices -> (..., 8) coefficients (normalized so that the last entry is 1).
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    flat = matrix.reshape(matrix.shape[:-2] + (9,))
+    return flat[..., :8] / flat[..., 8:9]
+
+
+def scale_coeffs(sx, sy=None):
+    """
+    Coefficients of a scaling about the origin.
+    """
+    sy = sx if sy is None else sy
+    return np.array([sx, 0, 0, 0, sy, 0, 0, 0], dtype=np.float64)
+
+
+def compose_coeffs(*coeffs):
+    """
+    Coefficients applying each of `coeffs` in turn (the first one first).
+    """
+    matrix = np.eye(3)
+    for c in coeffs:
+        matrix = coeffs_to_matrix(c) @ matrix
+    return matrix_to_coeffs(matrix)
+
+
+def solve_homography(source_coords, target_coords):
+    """
+    Solves the perspective mapping source -> target from 4 point pairs.
+    Returns (forward, backward) coefficient arrays: forward maps source to target,
+    backward (the inverse, as PIL's transform expects) maps target to source.
+    """
+    src = np.asarray(source_coords, dtype=np.float64)
+    dst = np.asarray(target_coords, dtype=np.float64)
+
+    # a*x + b*y + c - g*x*X - h*y*X = X
+    # d*x + e*y + f - g*x*Y - h*y*Y = Y
+    A = np.zeros((8, 8))
+    A[0::2, 0] = src[:, 0]
+    A[0::2, 1] = src[:, 1]
+    A[0::2, 2] = 1
+    A[0::2, 6] = -src[:, 0] * dst[:, 0]
+    A[0::2, 7] = -src[:, 1] * dst[:, 0]
+    A[1::2, 3] = src[:, 0]
+    A[1::2, 4] = src[:, 1]
+    A[1::2, 5] = 1
+    A[1::2, 6] = -src[:, 0] * dst[:, 1]
+    A[1::2, 7] = -src[:, 1] * dst[:, 1]
+    b = dst.reshape(8)
+
+    try:
+        forward = np.linalg.solve(A, b)
+    except np.linalg.LinAlgError:
+        raise ValueError("Singular matrix")
+
+    backward = matrix_to_coeffs(np.linalg.inv(coeffs_to_matrix(forward)))
+    return forward, backward
+
+
+def transform_points(points, coeffs):
+    """
+    Applies the perspective coefficients to an array of points.
+    points: (..., N, 2), coeffs: (8,) or (..., 8) broadcasting over the leading dimensions.
+    Points whose denominator vanishes are returned unchanged.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    coeffs = np.asarray(coeffs, dtype=np.float64)[..., None, :]
+    a, b, c, d, e, f, g, h = np.moveaxis(coeffs, -1, 0)
+    x = points[..., 0]
+    y = points[..., 1]
+
+    denominator = g * x + h * y + 1
+    degenerate = np.abs(denominator) < 1e-10
+    denominator = np.where(degenerate, 1.0, denominator)
+    new_x = np.where(degenerate, x, (a * x + b * y + c) / denominator)
+    new_y = np.where(degenerate, y, (d * x + e * y + f) / denominator)
+    return np.stack([new_x, new_y], axis=-1)
+
+
+def rect_corners(rects):
+    """
+    (..., 4) rects as (x, y, w, h) -> (..., 4, 2) corners (top-left, top-right, bottom-right, bottom-left).
+    """
+    rects = np.asarray(rects, dtype=np.float64)
+    x, y, w, h = np.moveaxis(rects, -1, 0)
+    return np.stack([
+        np.stack([x, y], axis=-1),
+        np.stack([x + w, y], axis=-1),
+        np.stack([x + w, y + h], axis=-1),
+        np.stack([x, y + h], axis=-1)
+    ], axis=-2)
+
+
+def transform_boxes(rects, coeffs, width, height):
+    """
+    Transforms axis-aligned rects (..., N, 4) given as (x, y, w, h) and returns the
+    axis-aligned boxes (..., N, 4) as (min_x, min_y, max_x, max_y) enclosing their
+    transformed corners, clipped to the width x height canvas.
+    A whole batch of images can be done at once with coeffs of shape (B, 8) and rects (B, N, 4).
+    """
+    rects = np.asarray(rects, dtype=np.float64)
+    coeffs = np.asarray(coeffs, dtype=np.float64)
+    corners = rect_corners(rects)                          # (..., N, 4, 2)
+    flat = corners.reshape(corners.shape[:-3] + (-1, 2))   # (..., N*4, 2)
+    tx = transform_points(flat, coeffs).reshape(corners.shape)
+
+    mins = tx.min(axis=-2)
+    maxs = tx.max(axis=-2)
+    min_x = np.maximum(0, mins[..., 0])
+    min_y = np.maximum(0, mins[..., 1])
+    max_x = np.minimum(width, maxs[..., 0])
+    max_y = np.minimum(height, maxs[..., 1])
+    return np.stack([min_x, min_y, max_x, max_y], axis=-1)
+
+
+def boxes_to_yolo(boxes, width, height):
+    """
+    (..., 4) boxes as (min_x, min_y, max_x, max_y) -> normalized YOLO (cx, cy, w, h) and a
+    mask of the boxes that still have a positive area.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    bw = boxes[..., 2] - boxes[..., 0]
+    bh = boxes[..., 3] - boxes[..., 1]
+    cx = boxes[..., 0] + bw / 2.0
+    cy = boxes[..., 1] + bh / 2.0
+    yolo = np.stack([cx / width, cy / height, bw / width, bh / height], axis=-1)
+    return yolo, (bw > 0) & (bh > 0)
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import threading
+from collections import Counter
+from contextlib import nullcontext
+
+# Optional per-stage timings and counters of the generator.
+# Disabled by default: stage() then returns a shared no-op context and count() returns at once.
+
+STAGES = ('background', 'sample', 'layout', 'sprites', 'paste', 'warp', 'composite', 'annotate', 'augment', 'resize', 'encode')
+
+_NULL = nullcontext()
+
+
+class _Timer:
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Stats:
+    """
+    Time spent per stage (total seconds and calls), event counters and emitted classes.
+    Thread safe, writer threads record their encode times here too.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.calls = Counter()
+        self.counters = Counter()
+        self.classes = Counter()
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        return _Timer(self, name)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.times[name] = self.times.get(name, 0.0) + seconds
+            self.calls[name] += 1
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def count_class(self, name, n=1):
+        with self._lock:
+            self.classes[name] += n
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'times': dict(self.times),
+                'calls': dict(self.calls),
+                'counters': dict(self.counters),
+                'classes': dict(self.classes)
+            }
+
+    def merge(self, data):
+        """
+        Adds another Stats (or its to_dict()) into this one.
+        """
+        if isinstance(data, Stats):
+            data = data.to_dict()
+        with self._lock:
+            for name, seconds in data['times'].items():
+                self.times[name] = self.times.get(name, 0.0) + seconds
+            self.calls.update(data['calls'])
+            self.counters.update(data['counters'])
+            self.classes.update(data['classes'])
+
+    def summary(self):
+        rows = []
+        total = sum(self.times.values())
+        rows.append(f"{'stage':<12}{'calls':>9}{'total s':>10}{'mean ms':>10}{'share':>8}")
+        known = [s for s in STAGES if s in self.times]
+        others = sorted(s for s in self.times if s not in STAGES)
+        for name in known + others:
+            seconds = self.times[name]
+            calls = self.calls[name]
+            rows.append(f"{name:<12}{calls:>9}{seconds:>10.2f}{seconds / calls * 1000 if calls else 0:>10.2f}"
+                        f"{seconds / total if total else 0:>8.1%}")
+        if self.counters:
+            rows.append("")
+            rows.append(f"{'counter':<24}{'count':>9}")
+            for name in sorted(self.counters):
+                rows.append(f"{name:<24}{self.counters[name]:>9}")
+        if self.classes:
+            rows.append("")
+            rows.append(f"{'class':<24}{'boxes':>9}")
+            for name, n in self.classes.most_common():
+                rows.append(f"{name:<24}{n:>9}")
+        return "\n".join(rows)
+
+    def dump(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+
+_stats = None
+
+
+def enable():
+    """
+    Turns instrumentation on for this process and returns the (new) Stats.
+    """
+    global _stats
+    _stats = Stats()
+    return _stats
+
+
+def disable():
+    global _stats
+    _stats = None
+
+
+def get_stats():
+    return _stats
+
+
+def stage(name):
+    if _stats is None:
+        return _NULL
+    return _stats.stage(name)
+
+
+def count(name, n=1):
+    if _stats is not None:
+        _stats.count(name, n)
+
+
+def count_class(name, n=1):
+    if _stats is not None:
+        _stats.count_class(name, n)
+
+
+def merge_dumps(stats, directory):
+    """
+    Merges every Stats dump (*.json) found in `directory` into `stats`.
+    """
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.json'):
+            with open(entry.path) as f:
+                stats.merge(json.load(f))
@@ -0,0 +1,366 @@
+import os
+import re
+import zlib
+import argparse
+import numpy as np
+from layout import CLASS_LIST
+from shards import IMAGE_EXTENSIONS, ShardReader
+
+# Columnar label index of a generated dataset, so dataset-wide questions (class histograms,
+# filters, splits) never open the label files.
+#
+# An index is a directory of .npz parts (or a single compacted .npz), each holding:
+#   sample level: sample_id, ext, background, set_file, blocks_dir  (one row per sample)
+#   box level:    sample (row in the sample columns), class_id, box (cx, cy, w, h YOLO normalized)
+# Every generator process appends its own parts, so a run (or later runs) only adds files.
+# When a sample id appears in several parts the most recently written one wins.
+
+LABEL_INDEX_DIR = 'label_index'
+
+SAMPLES_PER_PART = 10000
+
+SAMPLE_COLUMNS = ('sample_id', 'ext', 'background', 'set_file', 'blocks_dir')
+
+
+def _parse_rows(label_text):
+    """
+    Labels of a YOLO label file content, as a list of (class id, cx, cy, w, h).
+    """
+    rows = [line.split() for line in label_text.splitlines() if line.strip()]
+    return [(int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4])) for r in rows]
+
+
+# <seed>_<unit, 9 digits>[-<fan-out copy>]_<set name>, see generate_artificial_dataset.sample_id()
+SAMPLE_ID_RE = re.compile(r'^-?\d+_\d{9}(?:-\d+)?_(.+)$')
+
+
+def set_file_from_id(sample_id):
+    """
+    Set file of a generated sample, from its id (see sample_id()). '' for ids in any other
+    format, e.g. the <timestamp>_<set name> of older datasets, where it can not be told apart.
+    """
+    match = SAMPLE_ID_RE.match(sample_id)
+    return match.group(1) + '.txt' if match else ''
+
+
+def _write_npz(path, columns):
+    tmp_path = path + f".{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **columns)
+    os.replace(tmp_path, path)
+
+
+class LabelIndexWriter:
+    """
+    Collects the labels of generated samples and writes them as numbered index parts
+    <index_dir>/<prefix>-00000.npz of at most `samples_per_part` samples.
+    With samples_per_part=None nothing is written on its own, columns() gives the collected rows.
+    """
+
+    def __init__(self, index_dir, prefix='labels', samples_per_part=SAMPLES_PER_PART):
+        self.index_dir = index_dir
+        self.prefix = prefix
+        self.samples_per_part = samples_per_part
+        self.part_count = 0
+        self._reset()
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+
+    def _reset(self):
+        self._samples = {name: [] for name in SAMPLE_COLUMNS}
+        self._class_ids = []
+        self._boxes = []
+
+    def add(self, sample_id, labels, ext='', background='', set_file='', blocks_dir=''):
+        """
+        Adds a sample and its labels, a list of (class id, cx, cy, w, h).
+        """
+        row = len(self._samples['sample_id'])
+        for name, value in zip(SAMPLE_COLUMNS, (sample_id, ext, background, set_file, blocks_dir)):
+            self._samples[name].append(value)
+        for c, cx, cy, bw, bh in labels:
+            self._class_ids.append((row, c))
+            self._boxes.append((cx, cy, bw, bh))
+        if self.samples_per_part and row + 1 >= self.samples_per_part:
+            self.flush()
+
+    def columns(self):
+        columns = {name: np.asarray(values, dtype=str) for name, values in self._samples.items()}
+        pairs = np.asarray(self._class_ids, dtype=np.int64).reshape(-1, 2)
+        columns['sample'] = pairs[:, 0].astype(np.int32)
+        columns['class_id'] = pairs[:, 1].astype(np.int16)
+        columns['box'] = np.asarray(self._boxes, dtype=np.float32).reshape(-1, 4)
+        return columns
+
+    def flush(self):
+        if not self._samples['sample_id']:
+            return
+        columns = self.columns()
+        _write_npz(os.path.join(self.index_dir, f"{self.prefix}-{self.part_count:05d}.npz"), columns)
+        self.part_count += 1
+        self._reset()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def list_parts(path):
+    """
+    Index parts of `path` (a part file or an index directory), oldest first.
+    """
+    if os.path.isfile(path):
+        return [path]
+    parts = [os.path.join(path, f) for f in os.listdir(path) if f.endswith('.npz')]
+    return sorted(parts, key=lambda p: (os.path.getmtime(p), p))
+
+
+class LabelIndex:
+    """
+    Label index loaded in memory as NumPy columns (see the format at the top of this file).
+
+    Sample columns: sample_id, ext, background, set_file, blocks_dir.
+    Box columns: sample (row in the sample columns), class_id, box.
+    """
+
+    def __init__(self, columns):
+        for name in SAMPLE_COLUMNS:
+            setattr(self, name, columns[name])
+        self.sample = columns['sample']
+        self.class_id = columns['class_id']
+        self.box = columns['box']
+
+    @classmethod
+    def load(cls, path):
+        parts = [np.load(p) for p in list_parts(path)]
+        if not parts:
+            raise ValueError(f"No label index found in {path}")
+
+        samples = {name: np.concatenate([p[name] for p in parts]) for name in SAMPLE_COLUMNS}
+        offsets = np.cumsum([0] + [len(p['sample_id']) for p in parts[:-1]])
+        box_sample = np.concatenate([p['sample'].astype(np.int64) + off for p, off in zip(parts, offsets)])
+        class_id = np.concatenate([p['class_id'] for p in parts])
+        box = np.concatenate([p['box'] for p in parts])
+
+        # Keep the last occurrence of every sample id (newest part)
+        ids = samples['sample_id']
+        _, last = np.unique(ids[::-1], return_index=True)
+        keep = np.sort(len(ids) - 1 - last)
+        if len(keep) != len(ids):
+            remap = np.full(len(ids), -1, dtype=np.int64)
+            remap[keep] = np.arange(len(keep))
+            samples = {name: col[keep] for name, col in samples.items()}
+            box_sample = remap[box_sample]
+            kept = box_sample >= 0
+            box_sample, class_id, box = box_sample[kept], class_id[kept], box[kept]
+
+        columns = dict(samples, sample=box_sample.astype(np.int32), class_id=class_id, box=box)
+        return cls(columns)
+
+    def columns(self):
+        columns = {name: getattr(self, name) for name in SAMPLE_COLUMNS}
+        columns.update(sample=self.sample, class_id=self.class_id, box=self.box)
+        return columns
+
+    def save(self, path):
+        """
+        Writes the whole index as a single .npz (compacts an index directory).
+        """
+        _write_npz(path, self.columns())
+
+    @property
+    def num_samples(self):
+        return len(self.sample_id)
+
+    def __len__(self):
+        return len(self.class_id)
+
+    def class_histogram(self):
+        """
+        Boxes per class id, as an array of len(CLASS_LIST).
+        """
+        return np.bincount(self.class_id.astype(np.int64), minlength=len(CLASS_LIST))
+
+    def boxes_per_sample(self):
+        """
+        Boxes of each sample, as an array of num_samples.
+        """
+        return np.bincount(self.sample, minlength=self.num_samples)
+
+    def sample_mask(self, set_files=None, backgrounds=None, blocks_dirs=None, classes=None):
+        """
+        Boolean mask over samples: matching set files, backgrounds and blocks dirs
+        (file and directory names, as recorded) and holding at least one box of any of `classes`.
+        """
+        mask = np.ones(self.num_samples, dtype=bool)
+        for column, values in ((self.set_file, set_files), (self.background, backgrounds), (self.blocks_dir, blocks_dirs)):
+            if values is not None:
+                mask &= np.isin(column, list(values))
+        if classes is not None:
+            has_class = np.zeros(self.num_samples, dtype=bool)
+            has_class[self.sample[np.isin(self.class_id, [_class_id(c) for c in classes])]] = True
+            mask &= has_class
+        return mask
+
+    def select(self, mask):
+        """
+        New LabelIndex with only the samples of the boolean `mask` (and their boxes).
+        """
+        remap = np.cumsum(mask) - 1
+        kept = mask[self.sample]
+        columns = {name: getattr(self, name)[mask] for name in SAMPLE_COLUMNS}
+        columns.update(sample=remap[self.sample[kept]].astype(np.int32), class_id=self.class_id[kept], box=self.box[kept])
+        return LabelIndex(columns)
+
+    def filter(self, **kwargs):
+        return self.select(self.sample_mask(**kwargs))
+
+    def split(self, val_fraction=0.2, salt=''):
+        """
+        Boolean (train, val) masks over samples. A sample lands in the same split whatever
+        else is in the dataset, since the decision only depends on a hash of its id.
+        """
+        threshold = int(val_fraction * 2 ** 32)
+        hashes = np.fromiter((zlib.crc32((salt + s).encode()) for s in self.sample_id.tolist()),
+                             dtype=np.uint64, count=self.num_samples)
+        val = hashes < threshold
+        return ~val, val
+
+    def summary(self):
+        per_sample = self.boxes_per_sample()
+        rows = [f"{self.num_samples} samples, {len(self)} boxes", ""]
+        if self.num_samples:
+            rows[1:1] = [f"boxes per sample: mean {per_sample.mean():.1f}, max {per_sample.max()}, "
+                         f"{int((per_sample == 0).sum())} samples without boxes"]
+        rows.append(f"{'class':<16}{'boxes':>10}{'share':>8}")
+        hist = self.class_histogram()
+        total = max(1, int(hist.sum()))
+        for c, n in enumerate(hist.tolist()):
+            name = CLASS_LIST[c] if c < len(CLASS_LIST) else str(c)
+            rows.append(f"{name:<16}{n:>10}{n / total:>8.1%}")
+        sets, counts = np.unique(self.set_file, return_counts=True)
+        rows.append("")
+        rows.append(f"{'set':<16}{'samples':>10}")
+        for s, n in zip(sets.tolist(), counts.tolist()):
+            rows.append(f"{s or '?':<16}{n:>10}")
+        return "\n".join(rows)
+
+
+def _class_id(c):
+    return CLASS_LIST.index(c) if isinstance(c, str) else int(c)
+
+
+def load_label_index(path):
+    return LabelIndex.load(path)
+
+
+def _iter_label_files(directory):
+    entries = {}
+    with os.scandir(directory) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            entries.setdefault(stem, {})[ext.lower()] = entry.path
+    for stem in sorted(entries):
+        files = entries[stem]
+        if '.txt' not in files:
+            continue
+        image_ext = next((e for e in IMAGE_EXTENSIONS if e in files), '')
+        with open(files['.txt']) as f:
+            yield stem, image_ext, f.read()
+
+
+def rebuild_label_index(input_path, index_path):
+    """
+    Builds the index of an existing dataset: a directory of image + .txt pairs or of shards
+    (see shards.py). Backgrounds and blocks dirs are not recorded in those files, only the
+    set file (recovered from the sample id) is filled in.
+    Writes a single .npz at `index_path`.
+    """
+    writer = LabelIndexWriter(None, samples_per_part=None)
+    if os.path.isfile(input_path) or any(f.endswith('.tar') for f in os.listdir(input_path)):
+        with ShardReader(input_path) as reader:
+            samples = (reader.read_label(i) for i in range(len(reader)))
+            for sample_id, ext, label_text in samples:
+                writer.add(sample_id, _parse_rows(label_text), ext, set_file=set_file_from_id(sample_id))
+    else:
+        for sample_id, ext, label_text in _iter_label_files(input_path):
+            writer.add(sample_id, _parse_rows(label_text), ext, set_file=set_file_from_id(sample_id))
+    index = LabelIndex(writer.columns())
+    index.save(index_path)
+    print(f"Indexed {index.num_samples} samples and {len(index)} boxes from {input_path} into {index_path}")
+    return index
+
+
+def prune_label_index(index_dir, removed_ids, name='labels-pruned.npz'):
+    """
+    Compacts an index directory into a single part without the samples in `removed_ids`
+    (used after samples were deleted, see manifest.py). Returns the pruned LabelIndex.
+    """
+    parts = list_parts(index_dir)
+    if not parts:
+        return None
+    index = LabelIndex.load(index_dir)
+    index = index.select(~np.isin(index.sample_id, np.array(sorted(removed_ids), dtype=str)))
+    path = os.path.join(index_dir, name)
+    index.save(path)
+    for part in parts:
+        if os.path.abspath(part) != os.path.abspath(path):
+            os.remove(part)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, compact or query the label index of a generated dataset.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("rebuild", help="Index every label of a data/obj directory or of shards.")
+    p.add_argument("input", help="Directory with image + .txt pairs, shard file or directory of shards.")
+    p.add_argument("output", help="Index file to write (.npz).")
+
+    p = sub.add_parser("compact", help="Merge the parts of an index directory into one file.")
+    p.add_argument("input", help="Index directory.")
+    p.add_argument("output", help="Index file to write (.npz).")
+
+    p = sub.add_parser("info", help="Print sample, box and class counts.")
+    p.add_argument("input", help="Index directory or file.")
+    p.add_argument("--sets", help="Comma separated set files to keep.")
+    p.add_argument("--classes", help="Comma separated class names to keep (samples with any of them).")
+
+    p = sub.add_parser("split", help="Write train.txt and val.txt with the image paths of a stable split.")
+    p.add_argument("input", help="Index directory or file.")
+    p.add_argument("obj_dir", help="Directory holding the images, used to build the paths.")
+    p.add_argument("--val", type=float, default=0.2, help="Fraction of samples in the validation set.")
+    p.add_argument("--out-dir", default=".", help="Where train.txt and val.txt are written.")
+
+    args = parser.parse_args()
+    if args.command == "rebuild":
+        rebuild_label_index(args.input, args.output)
+    elif args.command == "compact":
+        index = load_label_index(args.input)
+        index.save(args.output)
+        print(f"Wrote {index.num_samples} samples and {len(index)} boxes to {args.output}")
+    elif args.command == "info":
+        index = load_label_index(args.input)
+        if args.sets or args.classes:
+            index = index.filter(set_files=args.sets.split(',') if args.sets else None,
+                                 classes=args.classes.split(',') if args.classes else None)
+        print(index.summary())
+    else:
+        index = load_label_index(args.input)
+        obj_dir = os.path.abspath(args.obj_dir)
+        paths = np.char.add(np.char.add(obj_dir + os.sep, index.sample_id), index.ext)
+        train, val = index.split(args.val)
+        os.makedirs(args.out_dir, exist_ok=True)
+        for name, mask in (('train.txt', train), ('val.txt', val)):
+            with open(os.path.join(args.out_dir, name), 'w') as f:
+                f.write('\n'.join(paths[mask].tolist()))
+        print(f"Training set: {int(train.sum())} images, validation set: {int(val.sum())} images")
+
+
+if __name__ == "__main__":
+    main()
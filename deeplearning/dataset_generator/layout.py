@@ -0,0 +1,180 @@
+import random
+from collections import Counter
+from sprites import sprite_size
+import instrumentation
+
+# Define granular classes
+CLASS_LIST = [
+    'andar', 'circulo', 'inicio', 'looping', 'pegar', 'pular', 'triangulo', 'zzz',
+    '2', '3', '4', '5', '6', '7', '8', '9',
+    'seta_up', 'seta_down', 'seta_left', 'seta_right'
+]
+CLASS_IDS = {name: i for i, name in enumerate(CLASS_LIST)}
+
+# Blocks that carry a direction arrow
+ARROW_BLOCKS = ('andar', 'pegar', 'pular')
+
+# Rotation (degrees, PIL convention) of seta.png for each direction
+ARROW_ANGLES = {'up': -45, 'down': 45 * 3, 'left': 45, 'right': 45 * 5}
+
+# Block sprites are scaled so that 550px of sprite width spans the whole background
+BLOCK_SCALE_WIDTH = 550
+
+MAX_LAYOUT_ATTEMPTS = 10
+
+REJECT_REASONS = ('block', 'arrow', 'digit')
+
+
+def block_scale(width):
+    return BLOCK_SCALE_WIDTH / width
+
+
+def _inside(x, y, w, h, width, height):
+    return x >= 0 and y >= 0 and (x + w) <= width and (y + h) <= height
+
+
+def block_classes(block):
+    """
+    Class names annotated for a sampled block when it fits the canvas (see plan_layout):
+    the block, its arrow and its digit.
+    """
+    classes = [block['name']] if block['name'] in CLASS_IDS else []
+    if 'direction' in block and block['name'] in ARROW_BLOCKS:
+        classes.append(f"seta_{block['direction'] if block['direction'] in ARROW_ANGLES else 'up'}")
+    if 'steps' in block and 1 < block['steps'] < 10:
+        classes.append(str(block['steps']))
+    return classes
+
+
+def plan_layout(blocks, blocks_dir, width, height, rng=random):
+    """
+    Computes where every block, arrow and digit of `blocks` lands on a width x height canvas,
+    using only the (cached) sprite sizes, no pixel work.
+
+    Returns (placements, None) or (None, reason) when something falls outside the canvas,
+    reason being 'block', 'arrow' or 'digit'. Each placement is a dict with:
+      sprite: sprite name in blocks_dir, size: resized sprite size,
+      angle: rotation applied after resizing (None for no rotation),
+      rect: final (x, y, w, h) on the canvas, class: class id (None if not annotated).
+    """
+    scale = block_scale(width)
+    placements = []
+
+    for b in blocks:
+        newwidth, newheight = sprite_size(blocks_dir, b['name'], scale)
+
+        # Check block bounds
+        if not _inside(b['x'], b['y'], newwidth, newheight, width, height):
+            return None, 'block'
+
+        placements.append({
+            'sprite': b['name'],
+            'size': (newwidth, newheight),
+            'angle': None,
+            'rect': (b['x'], b['y'], newwidth, newheight),
+            'class': CLASS_IDS.get(b['name'])
+        })
+
+        if 'direction' in b and b['name'] in ARROW_BLOCKS:
+            bnewwidth, bnewheight = sprite_size(blocks_dir, 'seta', scale)
+            arrowX = b['x'] + 64 + (rng.randint(-3, 3))
+            arrowY = b['y'] + (rng.randint(-3, 3))
+
+            # Bounds are checked on the arrow before rotation, as they always were
+            if not _inside(arrowX, arrowY, bnewwidth, bnewheight, width, height):
+                return None, 'arrow'
+
+            # Unknown directions keep the arrow unrotated and are annotated as 'up'
+            angle = ARROW_ANGLES.get(b['direction'])
+            dir_suffix = b['direction'] if angle is not None else 'up'
+            rwidth, rheight = sprite_size(blocks_dir, 'seta', scale, angle)
+
+            placements.append({
+                'sprite': 'seta',
+                'size': (bnewwidth, bnewheight),
+                'angle': angle,
+                'rect': (arrowX, arrowY, rwidth, rheight),
+                'class': CLASS_IDS.get(f"seta_{dir_suffix}")
+            })
+
+        if 'steps' in b and b['steps'] > 1 and b['steps'] < 10:
+            digit = str(b['steps'])
+            newwidth_move, newheight_move = sprite_size(blocks_dir, digit, scale)
+            stepX = b['x'] + 128 - 30 + (rng.randint(-3, 3))
+            stepY = b['y'] + rng.randint(-3, 3)
+
+            if not _inside(stepX, stepY, newwidth_move, newheight_move, width, height):
+                return None, 'digit'
+
+            placements.append({
+                'sprite': digit,
+                'size': (newwidth_move, newheight_move),
+                'angle': None,
+                'rect': (stepX, stepY, newwidth_move, newheight_move),
+                'class': CLASS_IDS.get(digit)
+            })
+
+    return placements, None
+
+
+def plan_scene(sampler, blocks_dir, width, height, rng=random, max_attempts=MAX_LAYOUT_ATTEMPTS, bias=None):
+    """
+    Samples layouts from a compiled set (setfile.SetSampler, with its class `bias`) until
+    one fits the canvas, at most `max_attempts` times.
+    Returns (placements or None, list of the rejection reasons of the discarded attempts).
+    """
+    rejects = []
+    for _ in range(max_attempts):
+        with instrumentation.stage('sample'):
+            blocks = sampler.sample(rng, bias)
+        with instrumentation.stage('layout'):
+            placements, reason = plan_layout(blocks, blocks_dir, width, height, rng)
+        if placements is not None:
+            return placements, rejects
+        instrumentation.count(f"rejected_{reason}")
+        rejects.append(reason)
+    instrumentation.count('scenes_aborted')
+    return None, rejects
+
+
+class LayoutStats:
+    """
+    Per set file counters of sampled layouts, rejections by reason and scenes given up.
+    """
+
+    def __init__(self):
+        self.scenes = Counter()
+        self.failed = Counter()
+        self.attempts = Counter()
+        self.rejects = {}
+
+    def add(self, set_name, rejects, ok):
+        self.scenes[set_name] += 1
+        self.attempts[set_name] += len(rejects) + (1 if ok else 0)
+        if not ok:
+            self.failed[set_name] += 1
+        self.rejects.setdefault(set_name, Counter()).update(rejects)
+
+    def merge(self, other):
+        self.scenes.update(other.scenes)
+        self.failed.update(other.failed)
+        self.attempts.update(other.attempts)
+        for set_name, rejects in other.rejects.items():
+            self.rejects.setdefault(set_name, Counter()).update(rejects)
+
+    def rejection_rate(self, set_name):
+        attempts = self.attempts[set_name]
+        return sum(self.rejects.get(set_name, Counter()).values()) / attempts if attempts else 0.0
+
+    def summary(self):
+        rows = []
+        header = f"{'set':<16}{'scenes':>8}{'failed':>8}{'layouts':>9}{'rejected':>10}" + "".join(f"{r:>8}" for r in REJECT_REASONS)
+        rows.append(header)
+        rows.append('-' * len(header))
+        for set_name in sorted(self.scenes):
+            rejects = self.rejects.get(set_name, Counter())
+            rows.append(
+                f"{set_name:<16}{self.scenes[set_name]:>8}{self.failed[set_name]:>8}{self.attempts[set_name]:>9}"
+                f"{self.rejection_rate(set_name):>9.1%} " + "".join(f"{rejects[r]:>8}" for r in REJECT_REASONS)
+            )
+        return "\n".join(rows)
@@ -0,0 +1,112 @@
+import os
+import json
+import hashlib
+
+# Manifest of a generated dataset, for incremental regeneration.
+#
+# Every work unit is keyed by a hash of everything its output depends on (set file contents,
+# background, blocks dir contents, seed, settings, generator version, see
+# generate_artificial_dataset.unit_key). The manifest maps each unit to its key and the
+# samples it wrote, so a rerun skips units whose key did not change, regenerates the others
+# and can delete the samples of units that are no longer part of the dataset.
+#
+# <output>/manifest.json: {"version": 1, "units": {"<unit index>": {"key", "samples", "ext"}}}
+
+MANIFEST_NAME = 'manifest.json'
+
+_digests = {}
+
+
+def file_digest(path):
+    """
+    sha1 of a file's contents, cached per (path, size, mtime) for the life of the process.
+    """
+    st = os.stat(path)
+    cache_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    digest = _digests.get(cache_key)
+    if digest is None:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        digest = _digests[cache_key] = h.hexdigest()
+    return digest
+
+
+def dir_digest(path):
+    """
+    Hash of the names and contents of every file in a directory (not recursive).
+    """
+    h = hashlib.sha1()
+    for name in sorted(os.listdir(path)):
+        full = os.path.join(path, name)
+        if os.path.isfile(full):
+            h.update(f"{name}:{file_digest(full)}\n".encode())
+    return h.hexdigest()
+
+
+def blocks_digest(path):
+    """
+    Digest of a blocks dir, or of a sprite atlas and its metadata file (see sprites.py).
+    """
+    if os.path.isdir(path):
+        return dir_digest(path)
+    json_path = os.path.splitext(path)[0] + '.json'
+    if os.path.exists(json_path):
+        return hashlib.sha1(f"{file_digest(path)}:{file_digest(json_path)}".encode()).hexdigest()
+    return file_digest(path)
+
+
+class Manifest:
+    """
+    Unit index -> {'key': unit key, 'samples': sample ids written, 'ext': image extension}.
+    """
+
+    def __init__(self, path, units=None):
+        self.path = path
+        self.units = units or {}
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path) as f:
+            data = json.load(f)
+        return cls(path, {int(k): v for k, v in data['units'].items()})
+
+    def is_current(self, index, key, ext):
+        """
+        Whether unit `index` was recorded with `key` and written as `ext` images.
+        """
+        entry = self.units.get(index)
+        return entry is not None and entry['key'] == key and entry['ext'] == ext
+
+    def get(self, index):
+        return self.units.get(index)
+
+    def set(self, index, key, samples, ext):
+        self.units[index] = {'key': key, 'samples': list(samples), 'ext': ext}
+
+    def remove(self, index):
+        return self.units.pop(index, None)
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': 1, 'units': {str(k): v for k, v in sorted(self.units.items())}}, f)
+        os.replace(tmp_path, self.path)
+
+
+def remove_samples(directory, sample_ids, ext):
+    """
+    Deletes the image and label files of `sample_ids`, returns how many samples had files.
+    """
+    removed = 0
+    for sample_id in sample_ids:
+        found = False
+        for path in (os.path.join(directory, sample_id + ext), os.path.join(directory, sample_id + ".txt")):
+            if os.path.exists(path):
+                os.remove(path)
+                found = True
+        removed += found
+    return removed
@@ -0,0 +1,156 @@
+import os
+import json
+import random
+from collections import Counter
+from layout import CLASS_IDS, block_classes
+from setfile import compile_set_file
+
+# Class-balanced scheduling of work units.
+#
+# Instead of walking loops x backgrounds x sets uniformly, every batch of units is planned
+# from the boxes still missing per class (the quotas): each unit gets the set file expected
+# to cover most of the relative deficits, a class bias for the random choices of that set
+# (see setfile.SetSampler.sample) and a background where that set's layouts rarely fall
+# outside the canvas. The run stops as soon as every quota is met.
+
+BIAS_STRENGTH = 4.0
+ESTIMATE_SAMPLES = 64
+BATCH_UNITS = 64
+# Units planned in a row without lowering any deficit before the quotas are given up
+MAX_STALLED_UNITS = 2000
+
+
+def parse_quotas(text):
+    """
+    Per class box targets from "zzz=2000,seta_left=1500", a JSON object or a JSON file path.
+    """
+    text = text.strip()
+    if text.startswith('{'):
+        quotas = json.loads(text)
+    elif os.path.isfile(text):
+        with open(text) as f:
+            quotas = json.load(f)
+    else:
+        quotas = {}
+        for item in text.split(','):
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise ValueError(f"Invalid quota '{item}', expected <class>=<boxes>")
+            quotas[name.strip()] = value
+    unknown = sorted(set(quotas) - set(CLASS_IDS))
+    if unknown:
+        raise ValueError(f"Unknown classes in quotas: {', '.join(unknown)}")
+    return {name: int(value) for name, value in quotas.items() if int(value) > 0}
+
+
+class ClassBalancedScheduler:
+    """
+    Plans work units ({'set_file', 'bg_file', 'bias'}) until the boxes written per class
+    reach `quotas` (class name -> boxes). Results of the generated units are fed back with
+    add(). Planning only depends on the seed and on the results of previous batches, so a
+    run is reproducible whatever the number of workers.
+    """
+
+    def __init__(self, quotas, config, bias_strength=BIAS_STRENGTH, estimate_samples=ESTIMATE_SAMPLES):
+        self.quotas = dict(quotas)
+        self.set_files = list(config['set_files'])
+        self.bg_files = list(config['bg_files'])
+        self.bias_strength = bias_strength
+        self.estimate_samples = estimate_samples
+        self.samplers = {f: compile_set_file(os.path.join(config['dirsets'], f)) for f in self.set_files}
+        self.rng = random.Random(f"{config['seed']}:scheduler")
+        self.counts = Counter()
+        self.scenes = Counter()
+        self.accepted = Counter()
+        self.uses = Counter()
+        self.units = 0
+
+        # A class no set file can produce would never be met, even with the strongest bias
+        bias = self.bias(self.quotas)
+        reachable = set()
+        for set_file in self.set_files:
+            reachable.update(c for c, n in self.expected(set_file, bias).items() if n > 0)
+        unreachable = sorted(set(self.quotas) - reachable)
+        if unreachable:
+            raise ValueError(f"No set file produces {', '.join(unreachable)}")
+
+    def deficits(self):
+        return {c: q - self.counts[c] for c, q in self.quotas.items() if self.counts[c] < q}
+
+    def done(self):
+        return not self.deficits()
+
+    def bias(self, deficits):
+        """
+        Class weights for the set samplers: classes missing the most weigh up to 1 + bias_strength.
+        """
+        return {c: 1.0 + self.bias_strength * d / self.quotas[c] for c, d in deficits.items()}
+
+    def expected(self, set_file, bias):
+        """
+        Expected boxes per class of one layout of `set_file`, estimated by sampling.
+        """
+        counts = Counter()
+        for blocks in self.samplers[set_file].sample_many(self.estimate_samples, self.rng, bias):
+            for block in blocks:
+                counts.update(block_classes(block))
+        return {c: n / self.estimate_samples for c, n in counts.items()}
+
+    def _acceptance(self, set_file, bg_file=None):
+        # Share of scenes that fit the canvas, starting optimistic (no scene seen: 1)
+        if bg_file is None:
+            scenes = sum(self.scenes[(set_file, b)] for b in self.bg_files)
+            accepted = sum(self.accepted[(set_file, b)] for b in self.bg_files)
+        else:
+            scenes, accepted = self.scenes[(set_file, bg_file)], self.accepted[(set_file, bg_file)]
+        return (accepted + 1) / (scenes + 1)
+
+    def plan(self, max_units=BATCH_UNITS, copies=1):
+        """
+        Next batch of at most `max_units` units, fewer when they are expected to meet the
+        quotas. `copies` is the number of images written per unit (the fan-out).
+        """
+        deficits = self.deficits()
+        if not deficits:
+            return []
+        bias = self.bias(deficits)
+        expected = {s: self.expected(s, bias) for s in self.set_files}
+        acceptance = {s: self._acceptance(s) for s in self.set_files}
+
+        def score(set_file, projected):
+            gain = sum(min(expected[set_file].get(c, 0.0), d) / self.quotas[c] for c, d in projected.items())
+            return gain * acceptance[set_file]
+
+        projected = {c: float(d) for c, d in deficits.items()}
+        units = []
+        while projected and len(units) < max_units:
+            set_file = max(self.set_files, key=lambda s: score(s, projected))
+            if score(set_file, projected) <= 0:
+                break
+            # Spread units over backgrounds, favoring the ones where this set rarely gets rejected
+            bg_file = min(self.bg_files, key=lambda b: (self.uses[(set_file, b)] + 1) / self._acceptance(set_file, b))
+            self.uses[(set_file, bg_file)] += 1
+            units.append({'set_file': set_file, 'bg_file': bg_file, 'bias': bias})
+            for c, n in expected[set_file].items():
+                if c in projected:
+                    projected[c] -= n * acceptance[set_file] * copies
+                    if projected[c] <= 0:
+                        del projected[c]
+        self.units += len(units)
+        return units
+
+    def add(self, result):
+        """
+        Feeds back the result of a unit planned by plan() (see generate_unit).
+        """
+        key = (result['set'], result['background'])
+        self.scenes[key] += 1
+        if result['ok']:
+            self.accepted[key] += 1
+        self.counts.update(result['classes'])
+
+    def summary(self):
+        rows = [f"{'class':<14}{'quota':>8}{'boxes':>8}", '-' * 30]
+        for c in sorted(self.quotas, key=CLASS_IDS.get):
+            rows.append(f"{c:<14}{self.quotas[c]:>8}{self.counts[c]:>8}")
+        return "\n".join(rows)
@@ -0,0 +1,128 @@
+import os
+import json
+import glob
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+# Batch mode shared by generate_collection_image.py and generate_imagesfolder_from_collection_image.py:
+# runs one job per input in a process pool, skips the jobs whose inputs and options did not
+# change since the last batch into the same output directory, and prints a timing summary.
+
+STATE_NAME = ".batch_state.json"
+
+
+def expand_inputs(patterns):
+    """
+    Paths matching the glob patterns (e.g. "img_blocks*"), sorted, without duplicates.
+    """
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or ([pattern] if os.path.exists(pattern) else [])
+        if not matches:
+            print(f"Warning: Nothing matches '{pattern}'.")
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def path_digest(path):
+    """
+    sha1 of a file, or of the names and contents of the files of a directory (not recursive).
+    """
+    h = hashlib.sha1()
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            full = os.path.join(path, name)
+            if os.path.isfile(full):
+                h.update(f"{name}:{path_digest(full)}\n".encode())
+        return h.hexdigest()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def job_key(job):
+    h = hashlib.sha1(json.dumps(job["options"], sort_keys=True).encode())
+    for path in job["inputs"]:
+        if path and os.path.exists(path):
+            h.update(f"{os.path.basename(path)}:{path_digest(path)}\n".encode())
+    return h.hexdigest()
+
+
+def _outputs_exist(job):
+    return all(os.path.exists(p) and (not os.path.isdir(p) or os.listdir(p)) for p in job["outputs"])
+
+
+def _run_job(fn, args):
+    start = time.perf_counter()
+    ok = fn(*args)
+    return ok, time.perf_counter() - start
+
+
+def run_batch(jobs, output_dir, processes=None, force=False):
+    """
+    Runs every job concurrently in a pool of `processes` processes. A job is a dict with
+    name, fn and args (fn(*args) does the work and returns a false value when it failed,
+    fn must be importable by the workers),
+    inputs (files or directories whose contents key the job), options (anything else
+    changing the result) and outputs (paths that must exist once it ran).
+
+    Jobs whose key is the one recorded in <output_dir>/.batch_state.json and whose
+    outputs exist are skipped, unless `force`. Returns {name: (status, seconds)}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    state_path = os.path.join(output_dir, STATE_NAME)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+
+    results = {}
+    pending = []
+    for job in jobs:
+        key = job_key(job)
+        if not force and state.get(job["name"]) == key and _outputs_exist(job):
+            results[job["name"]] = ("unchanged", 0.0)
+        else:
+            pending.append((job, key))
+
+    wall_start = time.perf_counter()
+    if pending:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [(job, key, pool.submit(_run_job, job["fn"], job["args"])) for job, key in pending]
+            for job, key, future in futures:
+                try:
+                    ok, seconds = future.result()
+                except Exception as e:
+                    print(f"Error processing {job['name']}: {e}")
+                    results[job["name"]] = ("failed", 0.0)
+                    continue
+                if ok and _outputs_exist(job):
+                    state[job["name"]] = key
+                    results[job["name"]] = ("done", seconds)
+                else:
+                    results[job["name"]] = ("failed", seconds)
+    wall = time.perf_counter() - wall_start
+
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, state_path)
+
+    print_summary(results, wall)
+    return results
+
+
+def print_summary(results, wall):
+    width = max([len(name) for name in results] + [4])
+    print(f"\n{'item':<{width}}  {'status':<10}{'seconds':>9}")
+    print("-" * (width + 21))
+    for name, (status, seconds) in results.items():
+        print(f"{name:<{width}}  {status:<10}{seconds:>9.2f}")
+    done = [s for status, s in results.values() if status == "done"]
+    print(f"{len(done)} processed, {sum(1 for status, _ in results.values() if status == 'unchanged')} unchanged, "
+          f"{sum(1 for status, _ in results.values() if status == 'failed')} failed "
+          f"in {wall:.2f}s ({sum(done):.2f}s of work)")
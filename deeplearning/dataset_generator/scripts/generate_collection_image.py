@@ -3,22 +3,174 @@ import os
 import json
 import math
 import argparse
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from PIL.PngImagePlugin import PngInfo
+from batch import expand_inputs, run_batch
 
-def generate_collection(input_dir, output_file):
+LAYOUTS = ("grid", "shelf", "maxrects")
+
+# Canvas widths tried by the shelf and maxrects layouts, as factors of sqrt(total area)
+WIDTH_FACTORS = (0.8, 0.9, 1.0, 1.1, 1.25, 1.5, 2.0)
+MAXRECTS_WIDTHS = 2
+
+
+def load_image(file_path):
+    """
+    Decodes an image once, as RGBA. Returns None (with a warning) when it can not be read.
+    """
+    try:
+        with Image.open(file_path) as img:
+            return img.convert("RGBA")
+    except Exception as e:
+        print(f"Warning: Could not open {os.path.basename(file_path)}: {e}")
+        return None
+
+
+def load_images(input_dir, file_list, workers=None):
+    """
+    Decodes every image of file_list in a single pass, on a thread pool (PIL decoders release the GIL).
+    Returns a list of (filename, RGBA image), in file_list order, without the unreadable ones.
+    """
+    paths = [os.path.join(input_dir, f) for f in file_list]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        images = list(pool.map(load_image, paths))
+    return [(f, img) for f, img in zip(file_list, images) if img is not None]
+
+
+def pack_shelf(sizes, width):
+    """
+    Shelf packing: rectangles sorted by height are placed left to right in rows ("shelves")
+    of at most `width`. Returns the (x, y) of every rectangle (in the order of sizes) and
+    the (width, height) used.
+    """
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    positions = [None] * len(sizes)
+    x = y = shelf_height = used_width = 0
+    for i in order:
+        w, h = sizes[i]
+        if x > 0 and x + w > width:
+            y += shelf_height
+            x = shelf_height = 0
+        positions[i] = (x, y)
+        x += w
+        used_width = max(used_width, x)
+        shelf_height = max(shelf_height, h)
+    return positions, (used_width, y + shelf_height)
+
+
+def _contains(a, b):
+    return a[0] <= b[0] and a[1] <= b[1] and a[0] + a[2] >= b[0] + b[2] and a[1] + a[3] >= b[1] + b[3]
+
+
+# Orders the maxrects layout places rectangles in (each one is tried, see pack)
+MAXRECTS_ORDERS = {
+    "height": lambda size: (-size[1], -size[0]),
+    "side": lambda size: (-max(size), -min(size)),
+}
+
+
+def pack_maxrects(sizes, width, order="height"):
+    """
+    MaxRects packing in a `width` wide strip, bottom-left rule: every rectangle (tallest or
+    longest side first, see MAXRECTS_ORDERS) goes to the free spot that keeps it highest up,
+    then leftmost. The free space is kept as the list of maximal free rectangles.
+    Same return value as pack_shelf.
+    """
+    sort_key = MAXRECTS_ORDERS[order]
+    order = sorted(range(len(sizes)), key=lambda i: sort_key(sizes[i]))
+    height = sum(h for _, h in sizes)
+    free = [(0, 0, width, height)]
+    positions = [None] * len(sizes)
+    used_width = used_height = 0
+    for i in order:
+        w, h = sizes[i]
+        best = None
+        for fx, fy, fw, fh in free:
+            if w <= fw and h <= fh and (best is None or (fy + h, fx) < (best[1] + h, best[0])):
+                best = (fx, fy)
+        x, y = best
+        positions[i] = best
+        used_width = max(used_width, x + w)
+        used_height = max(used_height, y + h)
+
+        # Split every free rectangle overlapping the placed one into its (up to 4) leftovers
+        kept = []
+        splits = []
+        for f in free:
+            fx, fy, fw, fh = f
+            if x >= fx + fw or x + w <= fx or y >= fy + fh or y + h <= fy:
+                kept.append(f)
+                continue
+            if x > fx:
+                splits.append((fx, fy, x - fx, fh))
+            if x + w < fx + fw:
+                splits.append((x + w, fy, fx + fw - x - w, fh))
+            if y > fy:
+                splits.append((fx, fy, fw, y - fy))
+            if y + h < fy + fh:
+                splits.append((fx, y + h, fw, fy + fh - y - h))
+        # Drop leftovers contained in another free rectangle (the kept ones are still maximal)
+        splits = sorted(set(splits), key=lambda r: -r[2] * r[3])
+        free = kept
+        for r in splits:
+            if not any(_contains(f, r) for f in free):
+                free.append(r)
+    return positions, (used_width, used_height)
+
+
+def pack(sizes, layout):
+    """
+    Packs `sizes` with the shelf or maxrects layout, trying several strip widths and keeping
+    the smallest area (then the squarest). Same return value as pack_shelf.
+    MaxRects is much slower than shelf packing, so it only tries the MAXRECTS_WIDTHS widths
+    where shelf packing did best. The best shelf packing competes too, so maxrects is never
+    worse than shelf.
+    """
+    area = sum(w * h for w, h in sizes)
+    min_width = max(w for w, _ in sizes)
+    widths = sorted({max(min_width, int(math.sqrt(area) * f)) for f in WIDTH_FACTORS})
+
+    def best_of(candidates):
+        best = None
+        for packer, width in candidates:
+            positions, (used_w, used_h) = packer(sizes, width)
+            key = (used_w * used_h, abs(used_w - used_h))
+            if best is None or key < best[0]:
+                best = (key, positions, (used_w, used_h), width)
+        return best
+
+    if layout == "shelf":
+        _, positions, used, _ = best_of((pack_shelf, w) for w in widths)
+        return positions, used
+
+    by_shelf = sorted(widths, key=lambda w: best_of([(pack_shelf, w)])[0])[:MAXRECTS_WIDTHS]
+    candidates = [(pack_shelf, by_shelf[0])]
+    candidates += [(functools.partial(pack_maxrects, order=order), w) for order in MAXRECTS_ORDERS for w in by_shelf]
+    _, positions, used, _ = best_of(candidates)
+    return positions, used
+
+
+def generate_collection(input_dir, output_file, layout="grid", workers=None):
     """
     Generates a single collection image from all images in the input_dir.
     Embeds metadata about individual images into the PNG file.
+
+    layout "grid" puts every image in a cell of the size of the largest one; "shelf" and
+    "maxrects" bin-pack them, which gives much smaller collections when sizes differ.
+    The metadata format is the same for every layout. Images are decoded once, on
+    `workers` threads. Returns whether the collection was written.
     """
     if not os.path.exists(input_dir):
         print(f"Error: Input directory '{input_dir}' does not exist.")
-        return
+        return False
 
     images_data = []
     max_width = 0
     max_height = 0
-    
+
+
     # specific to Ory img_blocks
     valid_extensions = {".png", ".jpg", ".jpeg", ".bmp"}
 
@@ -26,72 +178,61 @@ def generate_collection(input_dir, output_file):
 
     if not file_list:
         print(f"No valid images found in '{input_dir}'.")
-        return
+        return False
 
-    # Load all images to determine sizes
-    for filename in file_list:
-        file_path = os.path.join(input_dir, filename)
-        try:
-            with Image.open(file_path) as img:
-                # We need to keep the image data or path. 
-                # Since we want to paste them, let's keep the path and size.
-                # If images are small, we could force RGBA
-                w, h = img.size
-                images_data.append({
-                    "filename": filename,
-                    "path": file_path,
-                    "width": w,
-                    "height": h
-                })
-                max_width = max(max_width, w)
-                max_height = max(max_height, h)
-        except Exception as e:
-            print(f"Warning: Could not open {filename}: {e}")
+    # Decode all images once: their sizes drive the layout and they are pasted from memory
+    for filename, img in load_images(input_dir, file_list, workers):
+        w, h = img.size
+        images_data.append({
+            "filename": filename,
+            "image": img,
+            "width": w,
+            "height": h
+        })
+        max_width = max(max_width, w)
+        max_height = max(max_height, h)
 
     if not images_data:
         print("No processable images found.")
-        return
+        return False
 
-    # Simple layout strategy: Square-ish grid
     total_images = len(images_data)
-    grid_cols = math.ceil(math.sqrt(total_images))
-    grid_rows = math.ceil(total_images / grid_cols)
 
     # Calculate canvas size
     # We add a small padding between images just in case, though not strictly necessary if coordinates are exact.
     padding = 2
     margin = 30
-    
-    # We need to compute exact positions. 
-    # To keep it simple, let's just use the max dimensions for the cell size, 
-    # but we can pack them tighter if we wanted. 
-    # For now, uniform grid cell size based on max dimensions is safest and easiest implementation.
-    cell_width = max_width + padding
-    cell_height = max_height + padding
-    
-    canvas_width = grid_cols * cell_width + padding + (2 * margin)
-    canvas_height = grid_rows * cell_height + padding + (2 * margin)
 
-    print(f"Creating collection image: {canvas_width}x{canvas_height} for {total_images} images.")
+    if layout == "grid":
+        # Simple layout strategy: Square-ish grid
+        # Uniform grid cell size based on max dimensions is safest and easiest implementation.
+        grid_cols = math.ceil(math.sqrt(total_images))
+        grid_rows = math.ceil(total_images / grid_cols)
+        cell_width = max_width + padding
+        cell_height = max_height + padding
+
+        canvas_width = grid_cols * cell_width + padding + (2 * margin)
+        canvas_height = grid_rows * cell_height + padding + (2 * margin)
+        positions = [(margin + (idx % grid_cols) * cell_width + padding, margin + (idx // grid_cols) * cell_height + padding)
+                     for idx in range(total_images)]
+    else:
+        # Every image takes its own size plus the padding, same spacing as the grid
+        sizes = [(d["width"] + padding, d["height"] + padding) for d in images_data]
+        packed, (packed_width, packed_height) = pack(sizes, layout)
+        canvas_width = packed_width + padding + (2 * margin)
+        canvas_height = packed_height + padding + (2 * margin)
+        positions = [(margin + px + padding, margin + py + padding) for px, py in packed]
+
+    print(f"Creating collection image: {canvas_width}x{canvas_height} for {total_images} images ({layout} layout).")
 
     # Create Transparent Canvas
     collection_img = Image.new("RGBA", (canvas_width, canvas_height), (0, 0, 0, 0))
 
     metadata = []
 
-    for idx, img_info in enumerate(images_data):
-        col = idx % grid_cols
-        row = idx // grid_cols
-        
-        x = margin + col * cell_width + padding
-        y = margin + row * cell_height + padding
-        
-        # Open and paste
-        with Image.open(img_info["path"]) as src_img:
-            # Maintain original mode if possible, but convert to RGBA for consistency on the canvas
-            src_img_rgba = src_img.convert("RGBA")
-            collection_img.paste(src_img_rgba, (x, y))
-        
+    for img_info, (x, y) in zip(images_data, positions):
+        collection_img.paste(img_info["image"], (x, y))
+
         # Store relative coordinates (0.0 - 1.0)
         metadata.append({
             "filename": img_info["filename"],
@@ -123,20 +264,47 @@ def generate_collection(input_dir, output_file):
         
     print(f"Successfully saved collection to {output_file}")
     print(f"Successfully saved metadata to {json_path}")
+    return True
 
 
 def main():
     parser = argparse.ArgumentParser(description="Pack directory of images into a single collection PNG.")
     parser.add_argument("--input", "-i", default="../img_blocks", help="Input directory containing images.")
     parser.add_argument("--output", "-o", default="collection.png", help="Output PNG file.")
-    
+    parser.add_argument("--layout", "-l", choices=LAYOUTS, default="grid", help="grid: uniform cells sized by the largest image. shelf/maxrects: bin-packed, smaller collections.")
+    parser.add_argument("--workers", "-w", type=int, help="Threads decoding the input images. Default: one per CPU (up to 32).")
+    parser.add_argument("--batch", "-b", nargs="+", metavar="PATTERN", help="Pack every directory matching the glob patterns (e.g. '../img_blocks*') into <output-dir>/<name>.png, concurrently. Directories unchanged since the last batch are skipped.")
+    parser.add_argument("--output-dir", default="collections", help="Output directory of --batch.")
+    parser.add_argument("--processes", "-p", type=int, help="Directories packed at the same time in --batch. Default: one per CPU.")
+    parser.add_argument("--force", action="store_true", help="Repack every --batch directory, even unchanged ones.")
+
     args = parser.parse_args()
     
     # Resolve paths relative to script location if called directly, or cwd
     # If the user runs python scripts/generate... from root, relative paths might be tricky.
     # Let's trust the user's input path or default relative to CWD.
     
-    generate_collection(args.input, args.output)
+    if args.batch:
+        jobs = []
+        for input_dir in expand_inputs(args.batch):
+            if not os.path.isdir(input_dir):
+                continue
+            name = os.path.basename(os.path.normpath(input_dir))
+            output_file = os.path.join(args.output_dir, name + ".png")
+            jobs.append({
+                "name": name,
+                "fn": generate_collection,
+                "args": (input_dir, output_file, args.layout, args.workers),
+                "inputs": [input_dir],
+                "options": {"layout": args.layout},
+                "outputs": [output_file, os.path.splitext(output_file)[0] + ".json"],
+            })
+        if not jobs:
+            parser.error("--batch: no input directories found.")
+        run_batch(jobs, args.output_dir, args.processes, args.force)
+        return
+
+    generate_collection(args.input, args.output, args.layout, args.workers)
 
 if __name__ == "__main__":
     main()
@@ -2,15 +2,101 @@
 import os
 import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from PIL import Image
+from batch import expand_inputs, run_batch
 
-def generate_images_folder(input_file, output_dir, json_file=None, magenta_threshold=100):
+# Rows processed at a time when comparing pixels to the background color (bounds memory on huge upscales)
+MASK_CHUNK_ROWS = 512
+
+
+def _candidate_mask(pixels, background, thresh):
+    """
+    Pixels whose color differs from `background` by at most `thresh` (sum of the absolute
+    channel differences, as ImageDraw.floodfill).
+    """
+    mask = np.empty(pixels.shape[:2], dtype=bool)
+    for start in range(0, pixels.shape[0], MASK_CHUNK_ROWS):
+        chunk = pixels[start:start + MASK_CHUNK_ROWS]
+        # Channel by channel: much faster than a sum over the last axis
+        diff = np.zeros(chunk.shape[:2], dtype=np.int16)
+        for channel, value in enumerate(background):
+            diff += np.abs(chunk[..., channel].astype(np.int16) - value)
+        mask[start:start + MASK_CHUNK_ROWS] = diff <= thresh
+    return mask
+
+
+def background_mask(pixels, seed, thresh):
+    """
+    Mask of the pixels ImageDraw.floodfill(image, seed, (0, 0, 0, 0), thresh=thresh) would
+    clear: the 4-connected region of the seed made of pixels within `thresh` of the seed color.
+    `pixels` is an HxWxC uint8 array, `seed` an (x, y) point.
+
+    Vectorized: every row is split into runs of candidate pixels, runs of neighbouring rows
+    sharing a column are linked, and the component of the seed's run is found with a
+    breadth-first search over runs (one NumPy step per level instead of one per pixel).
+    """
+    height, width = pixels.shape[:2]
+    x, y = seed
+    background = tuple(int(v) for v in pixels[y, x])
+    # Like floodfill, nothing to do when the seed already has the fill color
+    if sum(background) <= thresh:
+        return np.zeros((height, width), dtype=bool)
+
+    candidate = _candidate_mask(pixels, background, thresh)
+
+    # Run ids (from 1, 0 outside the candidates): a run starts at every candidate pixel
+    # whose left neighbour is not a candidate (or that starts a row)
+    starts = candidate.copy()
+    starts[:, 1:] &= ~candidate[:, :-1]
+    run_ids = np.cumsum(starts, axis=None, dtype=np.int64).reshape(height, width)
+    run_ids *= candidate
+    num_runs = int(run_ids.max()) if run_ids.size else 0
+
+    # Runs of consecutive rows touching in some column are connected (both directions).
+    # Two runs overlap on one interval of columns: only its first column is kept
+    touching = candidate[:-1] & candidate[1:]
+    first_column = touching.copy()
+    first_column[:, 1:] &= ~touching[:, :-1] | starts[:-1, 1:] | starts[1:, 1:]
+    upper, lower = run_ids[:-1][first_column], run_ids[1:][first_column]
+    source = np.concatenate([upper, lower])
+    target = np.concatenate([lower, upper])
+    order = np.argsort(source, kind='stable')
+    target = target[order]
+    offsets = np.searchsorted(source[order], np.arange(num_runs + 2))
+
+    reached = np.zeros(num_runs + 1, dtype=bool)
+    frontier = np.array([run_ids[y, x]])
+    reached[frontier] = True
+    while frontier.size:
+        first, last = offsets[frontier], offsets[frontier + 1]
+        counts = last - first
+        # Indexes of every neighbour of the frontier runs in `target`
+        index = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        neighbours = np.unique(target[index])
+        frontier = neighbours[~reached[neighbours]]
+        reached[frontier] = True
+    return reached[run_ids] & candidate
+
+
+def _save_sprite(image, size, output_path):
+    # Resize back to the original size (LANCZOS, good for downsampling AI upscales) and save
+    if size and image.size != size:
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    image.save(output_path)
+
+
+def generate_images_folder(input_file, output_dir, json_file=None, magenta_threshold=100, workers=None):
     """
     Extracts images from a collection PNG based on embedded metadata or external JSON.
+    The background connected to the top-right corner is made transparent first (see
+    background_mask), then sprites are resized and saved on `workers` threads.
+    Returns whether every sprite was extracted.
     """
     if not os.path.exists(input_file):
         print(f"Error: Input file '{input_file}' does not exist.")
-        return
+        return False
 
     metadata = None
 
@@ -23,10 +109,10 @@ def generate_images_folder(input_file, output_dir, json_file=None, magenta_thres
                 print(f"Loaded metadata from {json_file}")
             except Exception as e:
                 print(f"Error loading JSON {json_file}: {e}")
-                return
+                return False
         else:
             print(f"Error: Specified JSON file '{json_file}' not found.")
-            return
+            return False
 
     try:
         with Image.open(input_file) as img:
@@ -44,17 +130,13 @@ def generate_images_folder(input_file, output_dir, json_file=None, magenta_thres
 
             if metadata is None:
                 print("Error: No metadata available (neither external JSON nor embedded in PNG).")
-                return
-            
-            # --- Handle Background Removal (Flood Fill) ---
+                return False
             
             # --- Handle Background Removal (Flood Fill) ---
             # User request: "recorte o fundo" (cut out background)
-            # We use floodfill from corner (0,0) to remove the connected background.
+            # We flood fill from a corner to remove the connected background.
             # This is safer than global color replacement and works with the provided margin.
-            
-            from PIL import ImageDraw
-            
+
             img = img.convert("RGBA")
             
             # Get background color sample from top-right corner
@@ -65,12 +147,12 @@ def generate_images_folder(input_file, output_dir, json_file=None, magenta_thres
             print(f"Detected background color: {bg_sample} at {start_point}")
             print(f"Flood filling background from {start_point} with tolerance {magenta_threshold}...")
             
-            # Floodfill with transparency (0, 0, 0, 0)
+            # Floodfill with transparency (0, 0, 0, 0), same result as
+            # ImageDraw.floodfill(img, start_point, (0, 0, 0, 0), thresh=magenta_threshold)
             # 'thresh' parameter determines how similar the color must be to be filled.
-            try:
-                ImageDraw.floodfill(img, start_point, (0, 0, 0, 0), thresh=magenta_threshold)
-            except Exception as e:
-                print(f"Warning: Floodfill failed ({e}). Falling back to simple transparency is not implemented.")
+            pixels = np.array(img)
+            pixels[background_mask(pixels, start_point, magenta_threshold)] = 0
+            img = Image.fromarray(pixels, "RGBA")
             
             # -----------------------------------------
 
@@ -82,6 +164,11 @@ def generate_images_folder(input_file, output_dir, json_file=None, magenta_thres
             
             img_w, img_h = img.size
 
+            # Crops are cheap and done here, resizing and encoding go to the pool
+            pool = ThreadPoolExecutor(max_workers=workers)
+            jobs = []
+            failed = 0
+
             for item in metadata:
                 filename = item.get("filename")
                 
@@ -93,11 +180,11 @@ def generate_images_folder(input_file, output_dir, json_file=None, magenta_thres
                 rel_h = item.get("rel_height")
                 
                 if all(v is not None for v in [rel_x, rel_y, rel_w, rel_h]):
-                    # Calculate absolute
-                    x = int(rel_x * img_w)
-                    y = int(rel_y * img_h)
-                    width = int(rel_w * img_w)
-                    height = int(rel_h * img_h)
+                    # Calculate absolute (rounded: truncating 29.999... would shift the crop by a pixel)
+                    x = round(rel_x * img_w)
+                    y = round(rel_y * img_h)
+                    width = round(rel_w * img_w)
+                    height = round(rel_h * img_h)
                 else:
                     # Fallback to absolute if relative not present (old format)
                     x = item.get("x")
@@ -110,43 +197,74 @@ def generate_images_folder(input_file, output_dir, json_file=None, magenta_thres
                     continue
 
                 # Crop
+                crop_box = (x, y, x + width, y + height)
+                cropped_img = img.crop(crop_box)
+
+                # Resize back to original dimensions if specified and different
+                # User likely has a HUGE AI upscale and wants to downsample back to original block size.
+                orig_w = item.get("original_width")
+                orig_h = item.get("original_height")
+                size = (orig_w, orig_h) if orig_w and orig_h else None
+
+                output_path = os.path.join(output_dir, filename)
+                jobs.append((filename, pool.submit(_save_sprite, cropped_img, size, output_path)))
+
+            for filename, job in jobs:
                 try:
-                    crop_box = (x, y, x + width, y + height)
-                    cropped_img = img.crop(crop_box)
-                    
-                    # Resize back to original dimensions if specified and different
-                    orig_w = item.get("original_width")
-                    orig_h = item.get("original_height")
-                    
-                    if orig_w and orig_h:
-                        if (cropped_img.width != orig_w) or (cropped_img.height != orig_h):
-                            # Ensure we don't lose quality if downscaling, or keep quality if upscaling (though upscaling here means we are restoring from a smaller collection processing? unlikely based on user request)
-                            # User likely has a HUGE AI upscale and wants to downsample back to original block size.
-                            # Resampling.LANCZOS is good for high quality downsampling
-                            cropped_img = cropped_img.resize((orig_w, orig_h), Image.Resampling.LANCZOS)
-
-                    # Save
-                    output_path = os.path.join(output_dir, filename)
-                    cropped_img.save(output_path)
-                    
+                    job.result()
                 except Exception as e:
                     print(f"Error extracting {filename}: {e}")
+                    failed += 1
+            pool.shutdown()
 
             print("Extraction complete.")
+            return failed == 0
 
     except Exception as e:
         print(f"Error processing file: {e}")
+        return False
 
 def main():
     parser = argparse.ArgumentParser(description="Unpack collection PNG into a directory of images.")
-    parser.add_argument("--input", "-i", required=True, help="Input collection PNG file.")
+    parser.add_argument("--input", "-i", help="Input collection PNG file. Required unless --batch is given.")
     parser.add_argument("--output", "-o", default="restored_img_blocks", help="Output directory.")
     parser.add_argument("--json", "-j", help="Optional external JSON metadata file. Required if PNG does not contain metadata.")
     parser.add_argument("--magenta-threshold", "-t", type=int, default=100, help="Threshold for magenta transparency (0-255). Default 100.")
-    
+    parser.add_argument("--workers", "-w", type=int, help="Threads resizing and saving the sprites. Default: one per CPU (up to 32).")
+    parser.add_argument("--batch", "-b", nargs="+", metavar="PATTERN", help="Unpack every collection matching the glob patterns (e.g. 'atlas/*.png') into <output-dir>/<name>/, concurrently. The metadata is read from <name>.json next to each collection, then --json, then the PNG. Collections unchanged since the last batch are skipped.")
+    parser.add_argument("--output-dir", default="restored", help="Output directory of --batch.")
+    parser.add_argument("--processes", "-p", type=int, help="Collections unpacked at the same time in --batch. Default: one per CPU.")
+    parser.add_argument("--force", action="store_true", help="Unpack every --batch collection, even unchanged ones.")
+
     args = parser.parse_args()
-    
-    generate_images_folder(args.input, args.output, args.json, args.magenta_threshold)
+
+    if args.batch:
+        jobs = []
+        for input_file in expand_inputs(args.batch):
+            if not os.path.isfile(input_file) or not input_file.lower().endswith(".png"):
+                continue
+            name = os.path.splitext(os.path.basename(input_file))[0]
+            json_file = os.path.splitext(input_file)[0] + ".json"
+            if not os.path.exists(json_file):
+                json_file = args.json
+            output_dir = os.path.join(args.output_dir, name)
+            jobs.append({
+                "name": name,
+                "fn": generate_images_folder,
+                "args": (input_file, output_dir, json_file, args.magenta_threshold, args.workers),
+                "inputs": [input_file, json_file],
+                "options": {"magenta_threshold": args.magenta_threshold},
+                "outputs": [output_dir],
+            })
+        if not jobs:
+            parser.error("--batch: no collection PNGs found.")
+        run_batch(jobs, args.output_dir, args.processes, args.force)
+        return
+
+    if not args.input:
+        parser.error("--input is required unless --batch is given.")
+
+    generate_images_folder(args.input, args.output, args.json, args.magenta_threshold, args.workers)
 
 if __name__ == "__main__":
     main()
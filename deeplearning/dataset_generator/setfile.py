@@ -0,0 +1,197 @@
+import os
+import re
+import ast
+import random
+import operator
+
+# Set file DSL, one block per line:
+#   <name>=<x>,<y>[,<direction>[,<steps>]]
+#   ~['a','b',...]=...        -> name drawn from the list
+#   (a~b) inside any value    -> random integer in [a, b]
+#   last['x'], last['y']      -> value of the previous block
+#   direction 'random'        -> one of left/right/down/up
+#
+# Layouts can be drawn with a bias (see SetSampler.sample): weights per class name for the
+# names of '~[...]' lists, the 'random' directions (as seta_<direction>) and the digits of
+# steps given as a plain (a~b) range. Fixed values are never changed.
+
+DIRECTIONS = ['left', 'right', 'down', 'up']
+
+_RANGE_RE = re.compile(r'\(\s*([+-]?\d+)\s*~\s*([+-]?\d+)\s*\)')
+
+_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+_UNARY_OPS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+def _compile_node(node, where):
+    """
+    Turns a whitelisted expression AST into a closure f(rng, last).
+    Only numbers, arithmetic, last['key'] and (a~b) ranges are accepted.
+    """
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        value = node.value
+        return lambda rng, last: value
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        op = _BIN_OPS[type(node.op)]
+        left = _compile_node(node.left, where)
+        right = _compile_node(node.right, where)
+        return lambda rng, last: op(left(rng, last), right(rng, last))
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        op = _UNARY_OPS[type(node.op)]
+        operand = _compile_node(node.operand, where)
+        return lambda rng, last: op(operand(rng, last))
+
+    if (isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == 'last'
+            and isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str)):
+        key = node.slice.value
+        return lambda rng, last: last[key]
+
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == '__range__'
+            and len(node.args) == 2 and not node.keywords):
+        low, high = (int(ast.literal_eval(arg)) for arg in node.args)
+        return lambda rng, last: rng.randint(low, high)
+
+    raise ValueError(f"{where}: unsupported expression '{ast.unparse(node)}'")
+
+
+def compile_expression(text, where='<expr>'):
+    """
+    Compiles a set file value such as "last['x']+(-3~3)" into a closure f(rng, last).
+    """
+    source = _RANGE_RE.sub(r'__range__(\1,\2)', text.strip())
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"{where}: invalid expression '{text}' ({e.msg})")
+    return _compile_node(tree.body, where)
+
+
+def _compile_line(line, where):
+    name, sep, values = line.partition('=')
+    if not sep:
+        raise ValueError(f"{where}: expected '<name>=<values>'")
+
+    entry = {'name': name, 'choices': None, 'x': None, 'y': None, 'direction': None, 'steps': None, 'steps_range': None}
+    if name.startswith('~['):
+        try:
+            entry['choices'] = [str(c) for c in ast.literal_eval(name[1:])]
+        except (ValueError, SyntaxError):
+            raise ValueError(f"{where}: invalid name list {name[1:]}")
+        if not entry['choices']:
+            raise ValueError(f"{where}: empty name list")
+
+    fields = values.split(',')
+    if len(fields) > 0:
+        entry['x'] = compile_expression(fields[0], where)
+    if len(fields) > 1:
+        entry['y'] = compile_expression(fields[1], where)
+    if len(fields) > 2:
+        entry['direction'] = fields[2].strip()
+    if len(fields) > 3:
+        entry['steps'] = compile_expression(fields[3], where)
+        plain_range = _RANGE_RE.fullmatch(fields[3].strip())
+        if plain_range:
+            entry['steps_range'] = (int(plain_range.group(1)), int(plain_range.group(2)))
+    return entry
+
+
+class SetSampler:
+    """
+    A set file compiled once, able to draw any number of block layouts.
+    Blocks have the same keys proc_txt_file always produced: name, x, y[, direction[, steps]].
+    """
+
+    def __init__(self, path, entries):
+        self.path = path
+        self.entries = entries
+
+    def sample(self, rng=random, bias=None):
+        """
+        Draws one block layout. `bias` maps class names (layout.CLASS_LIST) to weights > 0 for
+        the random choices that decide a class: block names of a list, 'random' directions
+        (seta_<direction>) and steps of a plain range (digit names). Missing names weigh 1.
+        Without bias the draws are exactly the unbiased ones.
+        """
+        blocks = []
+        last = {}
+        for entry in self.entries:
+            block = {}
+            choices = entry['choices']
+            if not choices:
+                block['name'] = entry['name']
+            elif bias:
+                block['name'] = _weighted_choice(rng, choices, choices, bias)
+            else:
+                block['name'] = choices[rng.randint(0, len(choices) - 1)]
+            if entry['x'] is not None:
+                block['x'] = entry['x'](rng, last)
+            if entry['y'] is not None:
+                block['y'] = entry['y'](rng, last)
+            if entry['direction'] is not None:
+                block['direction'] = entry['direction']
+                if block['direction'] == 'random':
+                    if bias:
+                        block['direction'] = _weighted_choice(rng, DIRECTIONS, [f"seta_{d}" for d in DIRECTIONS], bias)
+                    else:
+                        block['direction'] = DIRECTIONS[rng.randint(0, 3)]
+            if entry['steps'] is not None:
+                if bias and entry['steps_range'] is not None:
+                    low, high = entry['steps_range']
+                    values = list(range(low, high + 1))
+                    block['steps'] = _weighted_choice(rng, values, [str(v) for v in values], bias)
+                else:
+                    block['steps'] = entry['steps'](rng, last)
+            blocks.append(block)
+            # Blocks are never mutated after being built, no copy needed
+            last = block
+        return blocks
+
+    def sample_many(self, n, rng=random, bias=None):
+        """
+        Returns `n` independently sampled block lists.
+        """
+        return [self.sample(rng, bias) for _ in range(n)]
+
+
+def _weighted_choice(rng, values, names, bias):
+    return rng.choices(values, weights=[bias.get(name, 1.0) for name in names])[0]
+
+
+def parse_set_file(path):
+    entries = []
+    with open(path, 'r') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entries.append(_compile_line(line, f"{path}:{lineno}"))
+    return SetSampler(path, entries)
+
+
+_compiled = {}
+
+
+def compile_set_file(path):
+    """
+    Compiled sampler for `path`, cached per process and refreshed when the file changes.
+    """
+    key = os.path.abspath(path)
+    mtime = os.stat(key).st_mtime_ns
+    cached = _compiled.get(key)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, parse_set_file(path))
+        _compiled[key] = cached
+    return cached[1]
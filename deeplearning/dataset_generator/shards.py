@@ -0,0 +1,274 @@
+import io
+import os
+import json
+import time
+import tarfile
+import argparse
+import threading
+from PIL import Image
+
+# Sharded dataset format:
+#   <prefix>-00000.tar       plain tar holding <id><image ext> and <id>.txt (YOLO labels) pairs
+#   <prefix>-00000.idx.json  {"shard": "<prefix>-00000.tar", "samples": [{"id", "ext", "image": [offset, size], "label": [offset, size]}]}
+# Offsets point at the member data inside the tar, so a sample is read with one seek.
+# A shard without index (e.g. interrupted run) is indexed by scanning the tar.
+
+SAMPLES_PER_SHARD = 10000
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+_BLOCK = tarfile.BLOCKSIZE
+
+
+def index_path(shard_path):
+    return os.path.splitext(shard_path)[0] + ".idx.json"
+
+
+class ShardWriter:
+    """
+    Appends samples to numbered tar shards of at most `samples_per_shard` samples.
+    Thread safe, so SampleWriter threads can share it.
+    """
+
+    def __init__(self, out_dir, prefix='shard', samples_per_shard=SAMPLES_PER_SHARD):
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.samples_per_shard = samples_per_shard
+        self.shard_count = 0
+        self._tar = None
+        self._path = None
+        self._samples = []
+        self._lock = threading.Lock()
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _open(self):
+        self._path = os.path.join(self.out_dir, f"{self.prefix}-{self.shard_count:05d}.tar")
+        self._tar = tarfile.open(self._path, "w", format=tarfile.USTAR_FORMAT)
+        self._samples = []
+        self.shard_count += 1
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+        # the tar offset is now past the data padded to a whole block
+        padded = (len(data) + _BLOCK - 1) // _BLOCK * _BLOCK
+        return [self._tar.offset - padded, len(data)]
+
+    def _close_shard(self):
+        self._tar.close()
+        with open(index_path(self._path), 'w') as f:
+            json.dump({'shard': os.path.basename(self._path), 'samples': self._samples}, f)
+        self._tar = None
+
+    def add(self, sample_id, ext, image_bytes, label_text):
+        with self._lock:
+            if self._tar is None:
+                self._open()
+            image = self._add_member(sample_id + ext, image_bytes)
+            label = self._add_member(sample_id + ".txt", label_text.encode())
+            self._samples.append({'id': sample_id, 'ext': ext, 'image': image, 'label': label})
+            if len(self._samples) >= self.samples_per_shard:
+                self._close_shard()
+
+    def close(self):
+        with self._lock:
+            if self._tar is not None:
+                self._close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def scan_shard(shard_path):
+    """
+    Builds the index of a shard by reading its tar headers.
+    """
+    samples = {}
+    order = []
+    with tarfile.open(shard_path, "r") as tar:
+        for member in tar:
+            stem, ext = os.path.splitext(member.name)
+            if stem not in samples:
+                samples[stem] = {'id': stem}
+                order.append(stem)
+            if ext == '.txt':
+                samples[stem]['label'] = [member.offset_data, member.size]
+            else:
+                samples[stem]['ext'] = ext
+                samples[stem]['image'] = [member.offset_data, member.size]
+    return [samples[s] for s in order if 'image' in samples[s] and 'label' in samples[s]]
+
+
+def load_index(shard_path):
+    idx = index_path(shard_path)
+    if os.path.exists(idx):
+        with open(idx) as f:
+            return json.load(f)['samples']
+    return scan_shard(shard_path)
+
+
+def list_shards(path):
+    if os.path.isfile(path):
+        return [path]
+    return sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.tar'))
+
+
+class ShardReader:
+    """
+    Reads samples from a shard file or a directory of shards.
+
+    reader[i] and reader.get(sample_id) give random access (one seek per member),
+    iterating streams every shard sequentially. Samples are (id, ext, image bytes, label text);
+    decode_image() turns the bytes into a PIL image.
+    """
+
+    def __init__(self, path):
+        self.shards = list_shards(path)
+        self._entries = []
+        for shard_idx, shard in enumerate(self.shards):
+            for sample in load_index(shard):
+                self._entries.append((shard_idx, sample))
+        self._ids = {sample['id']: i for i, (_, sample) in enumerate(self._entries)}
+        self._files = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _read(self, shard_idx, span):
+        f = self._files.get(shard_idx)
+        if f is None:
+            f = self._files[shard_idx] = open(self.shards[shard_idx], 'rb')
+        f.seek(span[0])
+        return f.read(span[1])
+
+    def __getitem__(self, i):
+        shard_idx, sample = self._entries[i]
+        return (sample['id'], sample['ext'], self._read(shard_idx, sample['image']),
+                self._read(shard_idx, sample['label']).decode())
+
+    def read_label(self, i):
+        """
+        (id, ext, label text) of sample `i`, without reading its image.
+        """
+        shard_idx, sample = self._entries[i]
+        return sample['id'], sample['ext'], self._read(shard_idx, sample['label']).decode()
+
+    def get(self, sample_id):
+        return self[self._ids[sample_id]]
+
+    def ids(self):
+        return [sample['id'] for _, sample in self._entries]
+
+    def __iter__(self):
+        for shard in self.shards:
+            pending = {}
+            with tarfile.open(shard, "r|") as tar:
+                for member in tar:
+                    stem, ext = os.path.splitext(member.name)
+                    data = tar.extractfile(member).read()
+                    other = pending.pop(stem, None)
+                    if other is None:
+                        pending[stem] = (ext, data)
+                        continue
+                    if ext == '.txt':
+                        yield stem, other[0], other[1], data.decode()
+                    else:
+                        yield stem, ext, data, other[1].decode()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def decode_image(image_bytes):
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    return img
+
+
+def convert_directory(obj_dir, out_dir, prefix='shard', samples_per_shard=SAMPLES_PER_SHARD):
+    """
+    Packs an existing data/obj directory (image + .txt pairs) into shards, without re-encoding.
+    """
+    entries = {}
+    with os.scandir(obj_dir) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            entries.setdefault(stem, {})[ext.lower()] = entry.path
+
+    count = 0
+    with ShardWriter(out_dir, prefix, samples_per_shard) as writer:
+        for stem in sorted(entries):
+            files = entries[stem]
+            image_ext = next((e for e in IMAGE_EXTENSIONS if e in files), None)
+            if image_ext is None or '.txt' not in files:
+                continue
+            with open(files[image_ext], 'rb') as f:
+                image_bytes = f.read()
+            with open(files['.txt'], 'r') as f:
+                label_text = f.read()
+            writer.add(stem, image_ext, image_bytes, label_text)
+            count += 1
+    print(f"Packed {count} samples from {obj_dir} into {writer.shard_count} shards in {out_dir}")
+    return count
+
+
+def extract_shards(path, obj_dir):
+    """
+    Unpacks shards back into a flat image + .txt directory (the layout the YOLO trainer reads).
+    """
+    os.makedirs(obj_dir, exist_ok=True)
+    count = 0
+    for sample_id, ext, image_bytes, label_text in ShardReader(path):
+        with open(os.path.join(obj_dir, sample_id + ext), 'wb') as f:
+            f.write(image_bytes)
+        with open(os.path.join(obj_dir, sample_id + ".txt"), 'w', newline="\n") as f:
+            f.write(label_text)
+        count += 1
+    print(f"Extracted {count} samples to {obj_dir}")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack, unpack or inspect sharded datasets.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("convert", help="Pack a data/obj directory into shards.")
+    p.add_argument("input", help="Directory with image + .txt pairs.")
+    p.add_argument("output", help="Output directory for the shards.")
+    p.add_argument("--prefix", default="shard", help="Shard file name prefix.")
+    p.add_argument("--samples-per-shard", type=int, default=SAMPLES_PER_SHARD)
+
+    p = sub.add_parser("extract", help="Unpack shards into a data/obj directory.")
+    p.add_argument("input", help="Shard file or directory of shards.")
+    p.add_argument("output", help="Output directory.")
+
+    p = sub.add_parser("info", help="Print the shards and sample count.")
+    p.add_argument("input", help="Shard file or directory of shards.")
+
+    args = parser.parse_args()
+    if args.command == "convert":
+        convert_directory(args.input, args.output, args.prefix, args.samples_per_shard)
+    elif args.command == "extract":
+        extract_shards(args.input, args.output)
+    else:
+        reader = ShardReader(args.input)
+        for shard in reader.shards:
+            print(shard)
+        print(f"{len(reader)} samples in {len(reader.shards)} shards")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import os
+import json
+import math
+import hashlib
+from functools import lru_cache
+import numpy as np
+from PIL import Image
+
+# A blocks dir is either a directory of <name>.png sprites or a collection atlas built by
+# scripts/generate_collection_image.py (a .png with the sprite rectangles in <atlas>.json
+# or in its 'collection_metadata' text chunk). An atlas is decoded once per process, or
+# memory-mapped from a raw copy in the atlas cache dir, and sprites are views of it.
+
+# Upper bound of resized sprites kept per process.
+# ~20 sprites x 9 block dirs x ~20 background widths (scales), a few tens of KB each.
+SPRITE_CACHE_SIZE = 4096
+
+# Upper bound of rotated variants: 4 arrow directions x 9 block dirs x ~20 scales.
+ROTATED_CACHE_SIZE = 1024
+
+
+_atlas_cache_dir = None
+
+
+def set_atlas_cache_dir(cache_dir):
+    """
+    Directory where decoded atlases are kept as raw .npy arrays, memory-mapped by later
+    runs and by every generator process instead of decoding the PNG. None to disable.
+    """
+    global _atlas_cache_dir
+    _atlas_cache_dir = cache_dir
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
+
+def is_atlas(blocks_dir):
+    return os.path.isfile(blocks_dir)
+
+
+def atlas_metadata_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def _read_atlas_metadata(path):
+    json_path = atlas_metadata_path(path)
+    if os.path.exists(json_path):
+        with open(json_path) as f:
+            return json.load(f)
+    with Image.open(path) as img:
+        text = img.info.get('collection_metadata')
+    if text is None:
+        raise ValueError(f"{path} has no collection metadata ({json_path} or embedded)")
+    return json.loads(text)
+
+
+def _decode_atlas(path):
+    with Image.open(path) as img:
+        return np.asarray(img.convert('RGBA'))
+
+
+def _atlas_pixels(path):
+    if not _atlas_cache_dir:
+        return _decode_atlas(path)
+    st = os.stat(path)
+    digest = hashlib.sha1(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:16]
+    raw_path = os.path.join(_atlas_cache_dir, f"{os.path.splitext(os.path.basename(path))[0]}-{digest}.npy")
+    if not os.path.exists(raw_path):
+        tmp_path = raw_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, _decode_atlas(path))
+        os.replace(tmp_path, raw_path)
+    return np.load(raw_path, mmap_mode='r')
+
+
+@lru_cache(maxsize=16)
+def _load_atlas(path):
+    """
+    (HxWx4 read-only pixels, {sprite name: (x, y, w, h, original w, original h)}) of an atlas.
+    """
+    pixels = _atlas_pixels(path)
+    pixels.flags.writeable = False
+    height, width = pixels.shape[:2]
+    rects = {}
+    for item in _read_atlas_metadata(path):
+        # Rounded like the collection unpacker, the atlas may have been upscaled
+        x, y = round(item['rel_x'] * width), round(item['rel_y'] * height)
+        w, h = round(item['rel_width'] * width), round(item['rel_height'] * height)
+        rects[os.path.splitext(item['filename'])[0]] = (x, y, w, h, item.get('original_width') or w, item.get('original_height') or h)
+    return pixels, rects
+
+
+def _atlas_sprite(path, name):
+    pixels, rects = _load_atlas(path)
+    if name not in rects:
+        raise KeyError(f"No sprite '{name}' in atlas {path}")
+    x, y, w, h, original_w, original_h = rects[name]
+    atlas_width = pixels.shape[1]
+    # Zero-copy: the image reads the atlas rows with the atlas stride
+    flat = pixels.reshape(-1)
+    img = Image.frombuffer('RGBA', (w, h), flat[(y * atlas_width + x) * 4:], 'raw', 'RGBA', atlas_width * 4, 1)
+    if (w, h) != (original_w, original_h):
+        # Upscaled atlas: back to the size the sprite was packed at, like the unpacker
+        img = img.resize((original_w, original_h), Image.LANCZOS)
+    return img
+
+
+def _normalize_dir(blocks_dir):
+    return os.path.abspath(blocks_dir)
+
+
+@lru_cache(maxsize=256)
+def _load_source(blocks_dir, name):
+    if is_atlas(blocks_dir):
+        return _atlas_sprite(blocks_dir, name)
+    img = Image.open(os.path.join(blocks_dir, name + '.png'))
+    img.load()
+    return img
+
+
+@lru_cache(maxsize=SPRITE_CACHE_SIZE)
+def _load_resized(blocks_dir, name, size):
+    return _load_source(blocks_dir, name).resize(size, Image.LANCZOS)
+
+
+@lru_cache(maxsize=ROTATED_CACHE_SIZE)
+def _load_rotated(blocks_dir, name, size, angle):
+    return _load_resized(blocks_dir, name, size).rotate(angle, expand=True, resample=Image.BICUBIC)
+
+
+def sprite_source(blocks_dir, name):
+    """
+    Returns the decoded sprite <blocks_dir>/<name>.png (or sprite <name> of the atlas
+    `blocks_dir`) at its original size.
+    The image is shared by every caller, treat it as read-only.
+    """
+    return _load_source(_normalize_dir(blocks_dir), name)
+
+
+def scaled_size(size, scale):
+    return (round(size[0] * scale), round(size[1] * scale))
+
+
+def rotated_size(size, angle):
+    """
+    Size of a (w, h) image after Image.rotate(angle, expand=True), computed like PIL does.
+    """
+    w, h = size
+    angle = angle % 360.0
+    if angle == 0 or angle == 180:
+        return w, h
+    if angle in (90, 270):
+        return h, w
+
+    rad = -math.radians(angle)
+    cos_a = round(math.cos(rad), 15)
+    sin_a = round(math.sin(rad), 15)
+    cx, cy = w / 2, h / 2
+    tx = cos_a * -cx + sin_a * -cy + cx
+    ty = -sin_a * -cx + cos_a * -cy + cy
+    xx = []
+    yy = []
+    for x, y in ((0, 0), (w, 0), (w, h), (0, h)):
+        xx.append(cos_a * x + sin_a * y + tx)
+        yy.append(-sin_a * x + cos_a * y + ty)
+    return math.ceil(max(xx)) - math.floor(min(xx)), math.ceil(max(yy)) - math.floor(min(yy))
+
+
+def sprite_size(blocks_dir, name, scale, angle=None):
+    """
+    Size (w, h) of the sprite once scaled by `scale` (and rotated by `angle`), without any image work.
+    """
+    size = scaled_size(sprite_source(blocks_dir, name).size, scale)
+    return size if angle is None else rotated_size(size, angle)
+
+
+def get_sprite(blocks_dir, name, size, angle=None):
+    """
+    Returns the sprite resized (LANCZOS) to `size`, then rotated by `angle` degrees
+    (BICUBIC, expand=True) when given.
+    Cached by (blocks_dir, name, size, angle), so each variant is decoded, resized and
+    rotated once per process. The image is shared by every caller, treat it as read-only.
+    """
+    blocks_dir = _normalize_dir(blocks_dir)
+    if angle is None:
+        return _load_resized(blocks_dir, name, tuple(size))
+    return _load_rotated(blocks_dir, name, tuple(size), angle)
@@ -0,0 +1,128 @@
+import os
+import numpy as np
+from layout import CLASS_LIST, MAX_LAYOUT_ATTEMPTS
+from generate_artificial_dataset import DEFAULT_BLOCK_DIRS, make_config, plan_unit, render_sample
+from augment import augment_image, augment_rng
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Attempts with a derived seed before __getitem__ gives up on an index
+MAX_UNIT_RETRIES = 10
+
+
+def _torch_worker():
+    """
+    (worker id, number of workers) inside a torch DataLoader worker, (0, 1) otherwise.
+    torch is optional: nothing here requires it.
+    """
+    try:
+        from torch.utils.data import get_worker_info
+    except ImportError:
+        return 0, 1
+    info = get_worker_info()
+    if info is None:
+        return 0, 1
+    return info.id, info.num_workers
+
+
+class SyntheticDataset:
+    """
+    In-memory view of the synthetic dataset generator, no file is written or read back.
+
+    Samples are (image, boxes, class_ids): image a HxWx3 (or HxWx4 with rgb=False) uint8 array,
+    boxes a (N, 4) float32 array of YOLO normalized (cx, cy, w, h) and class_ids a (N,) int64
+    array indexing CLASS_LIST (also available as dataset.names).
+
+    Sample `i` is the work unit `i` of generate_artificial_dataset.py with the same seed and
+    directories, so it is deterministic and identical to the image that script would write.
+
+    backend='numpy' composites straight into arrays (see compositing.py), with the same pixels.
+    `augment` are photometric augmentation parameters (see augment.load_params), seeded per sample.
+
+    Map-style: dataset[i] for i < length (length is required for len()). Works as is with a
+    torch DataLoader and any number of workers.
+    Iterable: iter(dataset) streams units in order (forever when length is None), skipping
+    scenes whose layouts were all rejected. Inside DataLoader workers, or after
+    shard(num_workers, worker_id), each worker streams a disjoint slice of the units.
+    """
+
+    def __init__(self, seed=0, length=None, bg_dir=None, sets_dir=None, block_dirs=None,
+                 max_layout_attempts=MAX_LAYOUT_ATTEMPTS, rgb=True, backend='pil', augment=None):
+        bg_dir = bg_dir or os.path.join(_HERE, 'bg')
+        sets_dir = sets_dir or os.path.join(_HERE, 'sets')
+        block_dirs = block_dirs or [os.path.join(_HERE, d) for d in DEFAULT_BLOCK_DIRS]
+        self.config = make_config(seed, bg_dir, sets_dir, diroutput=None, block_dirs=block_dirs,
+                                  max_layout_attempts=max_layout_attempts, augment=augment)
+        self.length = length
+        self.rgb = rgb
+        self.backend = backend
+        self.names = list(CLASS_LIST)
+        self._shard = None
+
+    def __len__(self):
+        if self.length is None:
+            raise TypeError("Unbounded SyntheticDataset has no length")
+        return self.length
+
+    def shard(self, num_workers, worker_id):
+        """
+        Restricts iteration to the units of `worker_id` out of `num_workers`.
+        """
+        self._shard = (worker_id, num_workers)
+        return self
+
+    def _to_arrays(self, image, labels):
+        if isinstance(image, np.ndarray):
+            image = np.ascontiguousarray(image[..., :3]) if self.rgb else image
+        else:
+            image = np.asarray(image.convert('RGB') if self.rgb else image)
+        boxes = np.asarray([label[1:] for label in labels], dtype=np.float32).reshape(-1, 4)
+        class_ids = np.asarray([label[0] for label in labels], dtype=np.int64)
+        return image, boxes, class_ids
+
+    def render_unit(self, index, config=None):
+        """
+        The sample of work unit `index`, or None when all of its layouts were rejected.
+        """
+        config = config or self.config
+        unit = plan_unit(index, config)
+        if unit['placements'] is None:
+            return None
+        image, labels = render_sample(unit['placements'], unit['bg_path'], blocks_dir=unit['blocks_dir'],
+                                      rng=unit['rng'], backend=self.backend)
+        if config['augment']:
+            image = augment_image(image, config['augment'], augment_rng(config['seed'], index))
+        return self._to_arrays(image, labels)
+
+    def __getitem__(self, index):
+        if self.length is not None and not 0 <= index < self.length:
+            raise IndexError(index)
+        sample = self.render_unit(index)
+        retry = 0
+        while sample is None and retry < MAX_UNIT_RETRIES:
+            # Same unit with a derived seed, still deterministic
+            retry += 1
+            sample = self.render_unit(index, dict(self.config, seed=f"{self.config['seed']}-retry{retry}"))
+        if sample is None:
+            raise RuntimeError(f"No valid layout for unit {index} after {MAX_UNIT_RETRIES} retries")
+        return sample
+
+    def __iter__(self):
+        worker_id, num_workers = self._shard or _torch_worker()
+        index = worker_id
+        while self.length is None or index < self.length:
+            sample = self.render_unit(index)
+            if sample is not None:
+                yield sample
+            index += num_workers
+
+
+def iter_samples(seed=0, count=None, **kwargs):
+    """
+    Shortcut: streams `count` samples (forever when None) of a SyntheticDataset.
+    """
+    dataset = SyntheticDataset(seed=seed, **kwargs)
+    for produced, sample in enumerate(dataset):
+        if count is not None and produced >= count:
+            return
+        yield sample
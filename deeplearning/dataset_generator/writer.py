@@ -0,0 +1,198 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+import instrumentation
+
+# format name -> (PIL format, file extension)
+IMAGE_FORMATS = {
+    'png': ('PNG', '.png'),
+    'jpg': ('JPEG', '.jpg'),
+    'webp': ('WEBP', '.webp'),
+}
+
+# JPEG has no alpha channel
+_RGB_ONLY = {'jpg'}
+
+
+def encoder_options(image_format, quality=95, compress_level=6):
+    if image_format == 'png':
+        return {'compress_level': compress_level}
+    return {'quality': quality}
+
+
+def save_image(image, path, image_format='png', quality=95, compress_level=6, rgb=False):
+    """
+    Saves a generated RGBA frame (PIL image or HxWx4 uint8 array) with the given format options,
+    dropping alpha when asked (or required). `path` can also be a file object.
+    """
+    with instrumentation.stage('encode'):
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        if rgb or image_format in _RGB_ONLY:
+            image = image.convert('RGB')
+        image.save(path, IMAGE_FORMATS[image_format][0], **encoder_options(image_format, quality, compress_level))
+
+
+def resize_max_side(image, max_side):
+    """
+    `image` (PIL) scaled so its longest side is `max_side`, as YOLO's imgsz does.
+    Never upscales. Labels are normalized, they stay valid.
+    """
+    scale = max_side / max(image.size)
+    if scale >= 1:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    with instrumentation.stage('resize'):
+        return image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+def encode_image(image, image_format='png', quality=95, compress_level=6, rgb=False):
+    buffer = io.BytesIO()
+    save_image(image, buffer, image_format, quality, compress_level, rgb)
+    return buffer.getvalue()
+
+
+def save_image_file(image, path, image_format='png', quality=95, compress_level=6, rgb=False):
+    """
+    save_image to a temporary file renamed to `path`, so an interrupted run never leaves
+    a truncated image behind.
+    """
+    tmp_path = path + ".tmp"
+    save_image(image, tmp_path, image_format, quality, compress_level, rgb)
+    os.replace(tmp_path, path)
+
+
+def write_labels(items):
+    for path, text in items:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", newline="\n") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+class SampleWriter:
+    """
+    Encodes and writes generated samples on a thread pool, so encoding overlaps rendering.
+
+    At most `queue_size` images wait to be encoded: submit() blocks beyond that, which keeps
+    memory bounded when rendering is faster than encoding. Label files are buffered and
+    written `label_batch` at a time. Errors from the pool are raised by raise_errors() and
+    close().
+
+    With a `sink` (e.g. shards.ShardWriter) samples are not written as files: the encoded
+    image and its labels go to sink.add(sample_id, ext, image_bytes, label_text), the
+    sample id being the image file name without extension. close() also closes the sink.
+
+    `resolutions` is a list of (max_side, directory): every image is also written, scaled
+    down to each max_side (see resize_max_side), with the same file name and the same
+    labels in that directory. Each size is resized from the previous one, on the encoder
+    threads.
+    """
+
+    def __init__(self, image_format='png', quality=95, compress_level=6, rgb=False,
+                 threads=2, queue_size=16, label_batch=64, sink=None, resolutions=None):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown image format '{image_format}', expected one of {sorted(IMAGE_FORMATS)}")
+        if resolutions and sink is not None:
+            raise ValueError("Extra resolutions are only written as loose files, not to a sink")
+        self.image_format = image_format
+        self.quality = quality
+        self.compress_level = compress_level
+        self.rgb = rgb
+        self.label_batch = label_batch
+        self.sink = sink
+        self.resolutions = sorted(resolutions or [], reverse=True)
+        for _, directory in self.resolutions:
+            os.makedirs(directory, exist_ok=True)
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._labels = []
+        self._lock = threading.Lock()
+        self._errors = []
+        self.closed = False
+
+    @property
+    def extension(self):
+        return IMAGE_FORMATS[self.image_format][1]
+
+    def _done(self, future):
+        self._slots.release()
+        if future.exception() is not None:
+            with self._lock:
+                self._errors.append(future.exception())
+
+    def _submit(self, fn, *args):
+        self._slots.acquire()
+        self._pool.submit(fn, *args).add_done_callback(self._done)
+
+    def _save(self, image, path):
+        save_image_file(image, path, self.image_format, self.quality, self.compress_level, self.rgb)
+        if self.resolutions:
+            if isinstance(image, np.ndarray):
+                image = Image.fromarray(image)
+            name = os.path.basename(path)
+            for max_side, directory in self.resolutions:
+                image = resize_max_side(image, max_side)
+                save_image_file(image, os.path.join(directory, name), self.image_format, self.quality, self.compress_level, self.rgb)
+
+    def _save_to_sink(self, image, sample_id, label_text):
+        image_bytes = encode_image(image, self.image_format, self.quality, self.compress_level, self.rgb)
+        self.sink.add(sample_id, self.extension, image_bytes, label_text)
+
+    def submit(self, image, image_path, label_path=None, label_text=None):
+        """
+        Queues `image` to be saved at `image_path` and its labels at `label_path`.
+        The image must not be modified afterwards.
+        """
+        if self.sink is not None:
+            sample_id = os.path.splitext(os.path.basename(image_path))[0]
+            self._submit(self._save_to_sink, image, sample_id, label_text or "")
+            return
+        self._submit(self._save, image, image_path)
+        if label_path is not None:
+            label_name = os.path.basename(label_path)
+            with self._lock:
+                self._labels.append((label_path, label_text or ""))
+                self._labels.extend((os.path.join(directory, label_name), label_text or "") for _, directory in self.resolutions)
+                batch = self._labels if len(self._labels) >= self.label_batch else None
+                if batch is not None:
+                    self._labels = []
+            if batch is not None:
+                self._submit(write_labels, batch)
+
+    def flush_labels(self):
+        with self._lock:
+            batch, self._labels = self._labels, []
+        if batch:
+            self._submit(write_labels, batch)
+
+    def raise_errors(self):
+        """
+        Raises the first error of the samples finished so far, if any. Each error is raised once.
+        """
+        with self._lock:
+            errors, self._errors = self._errors, []
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        """
+        Writes pending labels, waits for every queued sample and raises the first error, if any.
+        """
+        if self.closed:
+            return
+        self.flush_labels()
+        self._pool.shutdown(wait=True)
+        if self.sink is not None:
+            self.sink.close()
+        self.closed = True
+        self.raise_errors()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,96 +1,223 @@
 import os
-import glob
+import sys
+import json
 import random
 import yaml
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
-def prepare_dataset(base_path):
+# Supported image extensions
+IMG_EXTS = ('.png', '.jpg', '.jpeg', '.webp')
+
+# Cache of the scanned dataset, next to train.txt/val.txt:
+# {"version": 1, "samples": {"<image name>": {"size", "mtime_ns", "label_size", "label_mtime_ns",
+#                                              "boxes", "max_class", "malformed", "split"}}}
+# A sample is only revalidated when its image or label size/mtime changed, and keeps its
+# train/val split for as long as it is in the dataset.
+MANIFEST_NAME = 'dataset_manifest.json'
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable manifest {path}: {e}")
+        return {}
+    if data.get('version') != 1:
+        return {}
+    return data['samples']
+
+
+def save_manifest(path, samples):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': 1, 'samples': samples}, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def scan_dir(obj_dir):
+    """
+    One os.scandir pass over obj_dir: {image name: (image stat, label stat)} for the images
+    with a label file, and the names of the images without one.
+    """
+    images = {}
+    labels = {}
+    with os.scandir(obj_dir) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            ext = ext.lower()
+            if ext in IMG_EXTS:
+                images[entry.name] = entry.stat()
+            elif ext == '.txt':
+                labels[stem] = entry.stat()
+
+    pairs = {}
+    missing = []
+    for name, st in images.items():
+        label_st = labels.get(os.path.splitext(name)[0])
+        if label_st is None:
+            missing.append(name)
+        else:
+            pairs[name] = (st, label_st)
+    return pairs, sorted(missing)
+
+
+def validate_label(txt_path):
+    """
+    Stats of a YOLO label file: boxes, highest class id (-1 when empty) and malformed lines
+    (not "<class> <x> <y> <w> <h>" with coordinates in [0, 1]).
+    """
+    boxes = 0
+    max_class = -1
+    malformed = 0
+    with open(txt_path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            try:
+                class_id = int(parts[0])
+                coords = [float(v) for v in parts[1:]]
+            except ValueError:
+                malformed += 1
+                continue
+            if class_id < 0 or len(coords) != 4 or not all(0.0 <= v <= 1.0 for v in coords):
+                malformed += 1
+                continue
+            boxes += 1
+            max_class = max(max_class, class_id)
+    return {'boxes': boxes, 'max_class': max_class, 'malformed': malformed}
+
+
+def _read_split(path):
+    # Image names listed in an existing train.txt/val.txt
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        return {os.path.basename(line.strip()) for line in f if line.strip()}
+
+
+def prepare_dataset(base_path, train_ratio=0.8, workers=None, seed=0):
     print(f"Preparing dataset in {base_path}")
-    
+
     # Paths
     data_dir = os.path.join(base_path, 'data')
     obj_dir = os.path.join(data_dir, 'obj')
     names_file = os.path.join(data_dir, 'obj.names')
-    
+    manifest_path = os.path.join(data_dir, MANIFEST_NAME)
+    train_txt = os.path.join(data_dir, 'train.txt')
+    val_txt = os.path.join(data_dir, 'val.txt')
+
     # 1. Read class names
     with open(names_file, 'r') as f:
         class_names = [line.strip() for line in f.readlines() if line.strip()]
-    
+
     print(f"Found {len(class_names)} classes: {class_names}")
-    
+
     # 2. Scan for images and labels
-    # Supported image extensions
-    img_exts = ['.png', '.jpg', '.jpeg']
-    
-    image_files = []
-    for ext in img_exts:
-        image_files.extend(glob.glob(os.path.join(obj_dir, f'*{ext}')))
-    
-    valid_pairs = []
-    
-    for img_path in image_files:
-        p = Path(img_path)
-        txt_path = p.with_suffix('.txt')
-        
-        if txt_path.exists():
-            valid_pairs.append(str(p))
+    pairs, missing = scan_dir(obj_dir)
+    for name in missing:
+        print(f"Warning: No label file for {name}")
+
+    manifest = load_manifest(manifest_path)
+    if not manifest:
+        # First run: keep the split of the train.txt/val.txt already there, if any
+        previous = {name: 'train' for name in _read_split(train_txt)}
+        previous.update({name: 'val' for name in _read_split(val_txt)})
+    else:
+        previous = {}
+
+    samples = {}
+    changed = []
+    for name, (st, label_st) in pairs.items():
+        entry = manifest.get(name)
+        if (entry is not None and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns
+                and entry['label_size'] == label_st.st_size and entry['label_mtime_ns'] == label_st.st_mtime_ns):
+            samples[name] = entry
+        else:
+            changed.append(name)
+    removed = len(set(manifest) - set(pairs))
+    print(f"Found {len(pairs)} image/label pairs: {len(samples)} unchanged, {len(changed)} new or changed, {removed} removed.")
+
+    # 3. Validate the labels of every new or changed sample
+    def validate(name):
+        return validate_label(os.path.join(obj_dir, os.path.splitext(name)[0] + '.txt'))
+
+    if changed:
+        print(f"Validating {len(changed)} label files...")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for name, stats in zip(changed, pool.map(validate, changed)):
+                st, label_st = pairs[name]
+                old = manifest.get(name) or {}
+                samples[name] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                                 'label_size': label_st.st_size, 'label_mtime_ns': label_st.st_mtime_ns,
+                                 **stats, 'split': old.get('split', previous.get(name))}
+
+    # Class ids are checked here, not cached, so editing obj.names needs no revalidation
+    valid = []
+    for name in sorted(samples):
+        entry = samples[name]
+        label_txt = os.path.splitext(name)[0] + '.txt'
+        if entry['max_class'] >= len(class_names):
+            print(f"ERROR: Class ID {entry['max_class']} found in {label_txt}, but only {len(class_names)} classes defined!")
+        elif entry['malformed']:
+            print(f"ERROR: {entry['malformed']} malformed lines in {label_txt}")
         else:
-            print(f"Warning: No label file for {p.name}")
-            
-    print(f"Found {len(valid_pairs)} valid image/label pairs.")
-    
-    if not valid_pairs:
+            valid.append(name)
+
+    print(f"Found {len(valid)} valid image/label pairs.")
+
+    if not valid:
         raise ValueError("No valid data found!")
 
-    # 3. verify labels are within range
-    # check a few random files to ensure class IDs are < len(class_names)
-    print("Verifying random samples...")
-    for _ in range(min(5, len(valid_pairs))):
-        sample_img = random.choice(valid_pairs)
-        sample_txt = str(Path(sample_img).with_suffix('.txt'))
-        with open(sample_txt, 'r') as f:
-            for line in f:
-                parts = line.strip().split()
-                if not parts: continue
-                class_id = int(parts[0])
-                if class_id >= len(class_names):
-                    print(f"ERROR: Class ID {class_id} found in {sample_txt}, but only {len(class_names)} classes defined!")
-
-    # 4. Split into train/val
-    random.shuffle(valid_pairs)
-    split_idx = int(len(valid_pairs) * 0.8)
-    train_files = valid_pairs[:split_idx]
-    val_files = valid_pairs[split_idx:]
-    
-    print(f"Training set: {len(train_files)} images")
+    # 4. Split into train/val: samples keep their split, only new ones are assigned,
+    # so that the validation set ends up as close as possible to 1 - train_ratio
+    new = [name for name in valid if samples[name]['split'] is None]
+    if new:
+        n_val = sum(1 for name in valid if samples[name]['split'] == 'val')
+        target_val = len(valid) - int(len(valid) * train_ratio)
+        new_val = min(max(target_val - n_val, 0), len(new))
+        random.Random(f"{seed}:{len(samples)}").shuffle(new)
+        for i, name in enumerate(new):
+            samples[name]['split'] = 'val' if i < new_val else 'train'
+
+    train_files = [os.path.join(obj_dir, name) for name in valid if samples[name]['split'] == 'train']
+    val_files = [os.path.join(obj_dir, name) for name in valid if samples[name]['split'] == 'val']
+
+    print(f"Training set: {len(train_files)} images ({len(new)} newly assigned)")
     print(f"Validation set: {len(val_files)} images")
-    
+
     # Write train.txt and val.txt (YOLO expects absolute paths usually, or relative to where command is run)
     # We will use absolute paths to be safe
-    with open(os.path.join(data_dir, 'train.txt'), 'w') as f:
+    with open(train_txt, 'w') as f:
         f.write('\n'.join(train_files))
-        
-    with open(os.path.join(data_dir, 'val.txt'), 'w') as f:
+
+    with open(val_txt, 'w') as f:
         f.write('\n'.join(val_files))
-        
+
+    save_manifest(manifest_path, samples)
+
     # 5. Generate dataset.yaml
     # YOLOv8 expects a yaml file pointing to train/val path (dir or txt file list)
     # and names dictionary
-    
+
     dataset_yaml = {
         'path': data_dir, # root
         'train': 'train.txt',
         'val': 'val.txt',
         'names': {i: name for i, name in enumerate(class_names)}
     }
-    
+
     yaml_path = os.path.join(base_path, 'dataset.yaml')
     with open(yaml_path, 'w') as f:
         yaml.dump(dataset_yaml, f, sort_keys=False)
-        
+
     print(f"Generated {yaml_path}")
     return yaml_path
 
 if __name__ == "__main__":
-    base_dir = os.path.dirname(os.path.abspath(__file__))
+    # Dataset root (holding data/obj and data/obj.names), this directory by default
+    base_dir = os.path.abspath(sys.argv[1]) if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
     prepare_dataset(base_dir)